@@ -0,0 +1,17 @@
+import os
+
+# Benchmarks always run against their own database, feature store and the local Foursquare stub
+# (set before the app reads its config, so a .env file cannot point them at real data)
+instance_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance')
+os.environ['SQLALCHEMY_DATABASE_URI'] = os.getenv('BENCHMARK_DATABASE_URI', 'sqlite:///benchmark.db')
+os.environ['FEATURE_STORE_PATH'] = os.getenv('BENCHMARK_FEATURE_STORE_PATH', os.path.join(instance_path, 'benchmark_feature_store'))
+os.environ['FOURSQUARE_API_URL'] = os.getenv('BENCHMARK_STUB_URL', 'http://127.0.0.1:8765')
+os.environ['FOURSQUARE_CACHE_BACKEND'] = 'memory'
+os.environ.setdefault('FOURSQUARE', 'benchmark')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REPORT_WORKERS', '0')
+
+from culinarycompass import app
+from culinarycompass import routes
+from culinarycompass import commands
+from benchmarks import bench_commands
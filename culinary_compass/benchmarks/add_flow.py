@@ -0,0 +1,55 @@
+import random
+from datetime import date
+
+from culinarycompass.models import User, Restaurant, RestaurantVisit
+from culinarycompass.taste_profile import TasteProfile
+from culinarycompass.visit_history import VisitHistory
+from culinarycompass import app, db
+
+from benchmarks.synthetic_data import SyntheticPlaces, BENCHMARK_PASSWORD, CITY_CENTRE
+
+# End-to-end check of the /add flow against the Foursquare stub (match, ingest, "Restaurant found!", visit, /my)
+class AddFlowCheck:
+
+    # Method for running the flow as the first benchmark user (returns the failed steps, the visit is removed after)
+    @staticmethod
+    def run(seed=None):
+        rng = random.Random(seed)
+        app.config['WTF_CSRF_ENABLED'] = False
+        client = app.test_client()
+        user = db.session.query(User).order_by(User.id).first()
+        if user is None:
+            raise ValueError("The benchmark database has no users, run 'bench seed' first.")
+        if client.post('/login', data={'email': user.email, 'password': BENCHMARK_PASSWORD}).status_code != 302:
+            return ["log in as the first benchmark user"]
+
+        # Search as the Google autocomplete would submit it (name and address, and the place coordinates)
+        lat, lng = SyntheticPlaces.random_point(rng, *CITY_CENTRE, 5)
+        response = client.post('/add', data={'name': 'Check Restaurant, 1 King St', 'place_latlng': f"{lat:.6f},{lng:.6f}",
+                                             'submit': 'Search'})
+        if b'Restaurant found!' not in response.data:
+            return ["search: the match was not reported as found"]
+        with client.session_transaction() as session:
+            fsq_id = session.get('fsq_id')
+        failures = []
+        if db.session.get(Restaurant, fsq_id) is None:
+            failures.append(f"search: {fsq_id} was reported as found but not stored")
+
+        # Submit the visit and check that it is listed on /my
+        response = client.post('/add', data={'date': date.today().isoformat(), 'rating': 4, 'submit': 'Add Restaurant'})
+        if response.status_code != 302:
+            failures.append(f"submit: expected a redirect to /my, got {response.status_code}")
+        db.session.remove()
+        visit = db.session.query(RestaurantVisit).filter_by(user_id=user.id, restaurant_id=fsq_id) \
+            .order_by(RestaurantVisit.id.desc()).first()
+        if visit is None:
+            return failures + ["submit: the visit was not stored"]
+        if b'Check Restaurant' not in client.get('/my').data:
+            failures.append("my: the visit is not listed")
+
+        # Remove the visit again, so the check can be repeated on the same database
+        db.session.delete(visit)
+        TasteProfile.rebuild(db.session.get(User, user.id))
+        db.session.commit()
+        VisitHistory.invalidate(user.id)
+        return failures
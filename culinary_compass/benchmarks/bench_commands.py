@@ -0,0 +1,133 @@
+import os
+import time
+import random
+
+import click
+
+from culinarycompass import app, db
+
+from benchmarks.synthetic_data import SyntheticData
+from benchmarks.stub_foursquare import StubFoursquare
+from benchmarks.micro import MicroBenchmarks
+from benchmarks.load import LoadHarness
+from benchmarks.reports import ReportBenchmark
+from benchmarks.add_flow import AddFlowCheck
+from benchmarks.results import BenchmarkReport
+
+# Default regression thresholds (checked into the repo next to the benchmarks)
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(__file__), 'thresholds.json')
+
+# Benchmark commands (run with `flask --app benchmarks bench <command>` from the culinary_compass directory)
+@app.cli.group('bench')
+def bench():
+    pass
+
+# Function to print results, write them to a file and exit with an error on regressions
+def report_results(results, thresholds, section, output, **details):
+    click.echo(BenchmarkReport.table(results))
+    if output:
+        BenchmarkReport.write(output, results, **details)
+        click.echo(f"Wrote {output}")
+    if thresholds:
+        failures = BenchmarkReport.regressions(results, BenchmarkReport.load_thresholds(thresholds, section))
+        for failure in failures:
+            click.echo(f"REGRESSION: {failure}")
+        if failures:
+            raise SystemExit(1)
+        click.echo("All benchmarks are within their thresholds.")
+
+# Function to start the Foursquare stub in process (or use one that is already listening on its port)
+def start_stub(latency):
+    try:
+        StubFoursquare.start(latency)
+    except OSError:
+        click.echo(f"Using the stub already listening at {app.config['FOURSQUARE_API_URL']}")
+
+# Command for generating the synthetic benchmark database
+@bench.command('seed')
+@click.option('--users', default=10000, help='Number of users.')
+@click.option('--restaurants', default=20000, help='Number of restaurants.')
+@click.option('--visits', default=1000000, help='Number of restaurant visits.')
+@click.option('--seed', default=1, help='Random seed (the same seed generates the same data).')
+def seed_data(users, restaurants, visits, seed):
+    rng = random.Random(seed)
+    click.echo(f"Generating the benchmark database {db.engine.url}")
+    start = time.perf_counter()
+    SyntheticData.reset()
+    steps = [('users', lambda: SyntheticData.generate_users(rng, users)),
+             ('restaurants', lambda: SyntheticData.generate_restaurants(rng, restaurants)),
+             ('visits', lambda: SyntheticData.generate_visits(rng, visits)),
+             ('taste profiles', SyntheticData.build_profiles)]
+    for name, step in steps:
+        step_start = time.perf_counter()
+        count = step()
+        click.echo(f"Created {count} {name} in {time.perf_counter() - step_start:.1f}s")
+    click.echo(f"Done in {time.perf_counter() - start:.1f}s. Run 'build-neighbours' and 'build-feature-store' "
+               f"with the same --app to benchmark with them.")
+
+# Command for running the Foursquare stub in the foreground (for benchmarks against a separate server process)
+@bench.command('stub-server')
+@click.option('--latency', default=0.0, help='Seconds added to every response.')
+def stub_server(latency):
+    StubFoursquare.start(latency)
+    click.echo(f"Serving stub Foursquare places at {app.config['FOURSQUARE_API_URL']} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        StubFoursquare.stop()
+
+# Command for running the micro-benchmarks of the recommendation stages and the report PDF
+@bench.command('micro')
+@click.option('--iterations', default=50, help='Timed calls per benchmark.')
+@click.option('--warmup', default=3, help='Untimed calls per benchmark.')
+@click.option('--users', default=20, help='Users sampled for the inputs.')
+@click.option('--only', multiple=True, help='Only run these benchmarks (repeatable).')
+@click.option('--stub-latency', default=0.0, help='Seconds added to every stub Foursquare response.')
+@click.option('--thresholds', default=DEFAULT_THRESHOLDS, help='Thresholds file (empty to skip the check).')
+@click.option('--output', default=None, help='Write the results to this JSON file.')
+def micro(iterations, warmup, users, only, stub_latency, thresholds, output):
+    start_stub(stub_latency)
+    results = MicroBenchmarks.run(iterations, warmup, users, only)
+    report_results(results, thresholds, 'micro', output, iterations=iterations)
+
+# Command for running the route load harness (in process, or against a running server with --base-url)
+@bench.command('load')
+@click.option('--concurrency', default=4, help='Concurrent virtual users.')
+@click.option('--rounds', default=10, help='Rounds of requests per virtual user.')
+@click.option('--base-url', default=None, help='URL of a running server, e.g. gunicorn (latency only, no query counts).')
+@click.option('--stub-latency', default=0.0, help='Seconds added to every stub Foursquare response.')
+@click.option('--thresholds', default=DEFAULT_THRESHOLDS, help='Thresholds file (empty to skip the check).')
+@click.option('--output', default=None, help='Write the results to this JSON file.')
+def load(concurrency, rounds, base_url, stub_latency, thresholds, output):
+    if base_url is None:
+        start_stub(stub_latency)
+    results, throughput = LoadHarness.run(concurrency, rounds, base_url)
+    click.echo(f"{throughput:.1f} requests/s with {concurrency} virtual users")
+    report_results(results, thresholds, 'load', output, concurrency=concurrency, rounds=rounds, throughput=throughput)
+
+# Command for measuring report rendering throughput (reports per second in one process)
+@bench.command('reports')
+@click.option('--count', default=100, help='Reports to render.')
+@click.option('--users', default=20, help='Users sampled for the reports.')
+@click.option('--min-rate', default=0.0, help='Fail if fewer reports per second are rendered.')
+@click.option('--output', default=None, help='Write the results to this JSON file.')
+def reports(count, users, min_rate, output):
+    result, rate = ReportBenchmark.run(count, users)
+    click.echo(f"{rate:.1f} reports/s")
+    report_results([result], None, 'reports', output, reports_per_second=rate)
+    if rate < min_rate:
+        click.echo(f"REGRESSION: {rate:.1f} reports/s < {min_rate:g}")
+        raise SystemExit(1)
+
+# Command for checking the /add flow end to end (the matched place is stored and the visit shows up on /my)
+@bench.command('check-add')
+@click.option('--seed', default=None, type=int, help='Random seed of the searched coordinates (default: random).')
+def check_add(seed):
+    start_stub(0.0)
+    failures = AddFlowCheck.run(seed)
+    for failure in failures:
+        click.echo(f"FAILED: {failure}")
+    if failures:
+        raise SystemExit(1)
+    click.echo("The /add flow stored the restaurant and listed the visit on /my.")
@@ -0,0 +1,129 @@
+import re
+import time
+import random
+import threading
+
+import requests
+
+from culinarycompass.models import User
+from culinarycompass import app, db
+
+from benchmarks.results import BenchmarkReport, QueryCounter
+from benchmarks.synthetic_data import SyntheticPlaces, BENCHMARK_PASSWORD, CITY_CENTRE
+
+# Requests made by every virtual user in each round (name, method, path, form data)
+LOAD_ROUTES = [
+    ('GET /my', 'GET', '/my', None),
+    ('GET /my?q', 'GET', '/my?q=pizza', None),
+    ('GET /find', 'GET', '/find', None),
+    ('POST /find', 'POST', '/find', {'radius': 5}),
+    ('GET /account', 'GET', '/account', None),
+]
+
+# CSRF token in a rendered form
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+# Virtual user on the Flask test client (same process, so SQL queries can be counted)
+class TestClientUser:
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    # Method for sending a request (returns the status code)
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+    # Method for sending a form without timing the page that provides its CSRF token
+    def prepare(self, method, path, data=None):
+        return lambda: self.request(method, path, data)
+
+# Virtual user of a running server, e.g. `gunicorn run:app` started with the benchmark environment
+class HttpUser:
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    # Method for sending a request (returns the status code)
+    def request(self, method, path, data=None):
+        return self.session.request(method, self.base_url + path, data=data, allow_redirects=False).status_code
+
+    # Method for preparing a request (forms first fetch the page for its CSRF token)
+    def prepare(self, method, path, data=None):
+        if method == 'POST' and data is not None:
+            match = CSRF_TOKEN_PATTERN.search(self.session.get(self.base_url + path).text)
+            data = dict(data, csrf_token=match.group(1)) if match else data
+        return lambda: self.request(method, path, data)
+
+# Route-level load harness for /my, /find and /account (concurrent virtual users logged in as synthetic users)
+class LoadHarness:
+
+    # Method for logging a virtual user in and sending its location (returns False if the login failed)
+    @staticmethod
+    def log_in(virtual_user, email, rng):
+        login = virtual_user.prepare('POST', '/login', {'email': email, 'password': BENCHMARK_PASSWORD})
+        if login() != 302:
+            return False
+        lat, lng = SyntheticPlaces.random_point(rng, *CITY_CENTRE, 5)
+        virtual_user.request('POST', '/update_coordinates', {'lat': f"{lat:.6f}", 'lng': f"{lng:.6f}"})
+        return True
+
+    # Method for running the rounds of one virtual user and recording each request
+    @staticmethod
+    def run_user(virtual_user, email, rounds, seed, samples, lock):
+        rng = random.Random(seed)
+        if not LoadHarness.log_in(virtual_user, email, rng):
+            with lock:
+                samples.append(('POST /login', 0.0, None, False))
+            return
+
+        count_queries = isinstance(virtual_user, TestClientUser)
+        for round_number in range(rounds):
+            for name, method, path, data in LOAD_ROUTES:
+                send = virtual_user.prepare(method, path, data)
+                QueryCounter.start()
+                start = time.perf_counter()
+                status = send()
+                elapsed = time.perf_counter() - start
+                queries = QueryCounter.stop() if count_queries else None
+                with lock:
+                    samples.append((name, elapsed, queries, status < 400))
+
+    # Method for running the load (test client unless a server URL is given) and summarizing each route
+    @staticmethod
+    def run(concurrency=4, rounds=10, base_url=None, seed=1):
+        rng = random.Random(seed)
+        QueryCounter.install()
+        if base_url is None:
+            # Forms are posted without fetching their CSRF tokens in process
+            app.config['WTF_CSRF_ENABLED'] = False
+        emails = [email for email, in db.session.query(User.email).order_by(User.id)]
+        emails = rng.sample(emails, min(concurrency, len(emails)))
+        db.session.remove()
+        if not emails:
+            raise ValueError("The benchmark database has no users, run 'bench seed' first.")
+
+        samples, lock, threads = [], threading.Lock(), []
+        for number, email in enumerate(emails):
+            virtual_user = HttpUser(base_url) if base_url else TestClientUser()
+            thread = threading.Thread(target=LoadHarness.run_user,
+                                      args=(virtual_user, email, rounds, rng.random(), samples, lock),
+                                      name=f"load-user-{number}")
+            threads.append(thread)
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        results = []
+        for name in dict.fromkeys(sample[0] for sample in samples):
+            route_samples = [sample for sample in samples if sample[0] == name]
+            query_counts = [queries for _, _, queries, _ in route_samples if queries is not None]
+            results.append(BenchmarkReport.summarize(name,
+                                                     [latency for _, latency, _, ok in route_samples if ok],
+                                                     query_counts,
+                                                     errors=sum(1 for *_, ok in route_samples if not ok)))
+        return results, len(samples) / elapsed if elapsed else 0.0
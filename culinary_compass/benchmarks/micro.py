@@ -0,0 +1,82 @@
+import time
+import random
+
+from culinarycompass.models import User
+from culinarycompass.taste_profile import TasteProfile
+from culinarycompass.restaurant_location import RestaurantLocation
+from culinarycompass.generate_recommendation import RecommendationGenerator
+from culinarycompass.generate_report import ReportGenerator
+from culinarycompass.item_neighbours import ItemNeighbours
+from culinarycompass import db
+
+from benchmarks.results import BenchmarkReport, QueryCounter
+from benchmarks.synthetic_data import SyntheticPlaces, CITY_CENTRE
+
+# Search radius (km) of the recommendation benchmarks
+BENCHMARK_RADIUS = 5
+
+# Micro-benchmarks of the recommendation stages and the report PDF
+class MicroBenchmarks:
+
+    # Method for preparing the inputs of one user (location, preferences and the candidates near them)
+    @staticmethod
+    def fixture(rng, user):
+        lat, lng = SyntheticPlaces.random_point(rng, *CITY_CENTRE, 5)
+        coords = f"{lat:.6f},{lng:.6f}"
+        top_categories, preferred_attributes = TasteProfile.get_preferences(user)
+        category_ids = [category_id for category_name, category_id in top_categories]
+        candidate_ids = []
+        for restaurant_ids in RestaurantLocation.nearby(coords, BENCHMARK_RADIUS, category_ids).values():
+            candidate_ids.extend(id for id in restaurant_ids if id not in candidate_ids)
+        return {'user_id': user.id,
+                'username': user.username,
+                'coords': coords,
+                'category_ids': category_ids,
+                'preferred_attributes': preferred_attributes,
+                'candidate_ids': candidate_ids}
+
+    # Method for getting the benchmarked calls of a fixture
+    @staticmethod
+    def cases(fixture):
+        return {
+            'taste_profile': lambda: TasteProfile.get_preferences(db.session.get(User, fixture['user_id'])),
+            'nearby_lookup': lambda: RestaurantLocation.nearby(fixture['coords'], BENCHMARK_RADIUS, fixture['category_ids']),
+            'restaurant_vectors': lambda: RecommendationGenerator.restaurant_vectors(fixture['candidate_ids']),
+            'collaborative_scores': lambda: ItemNeighbours.scores(fixture['user_id'], fixture['candidate_ids']),
+            'rank_restaurants': lambda: RecommendationGenerator.rank_restaurants(fixture['candidate_ids'],
+                                                                                 fixture['preferred_attributes'],
+                                                                                 user_id=fixture['user_id']),
+            'recommend': lambda: RecommendationGenerator.recommend(fixture['user_id'], fixture['coords'], BENCHMARK_RADIUS),
+            'create_pdf': lambda: ReportGenerator.create_pdf(fixture['username']),
+        }
+
+    # Method for running every case over a sample of users (each call starts with a fresh session, like a request)
+    @staticmethod
+    def run(iterations, warmup=3, users=20, only=None, seed=1):
+        rng = random.Random(seed)
+        QueryCounter.install()
+        user_ids = [id for id, in db.session.query(User.id).order_by(User.id)]
+        user_ids = rng.sample(user_ids, min(users, len(user_ids)))
+        if not user_ids:
+            raise ValueError("The benchmark database has no users, run 'bench seed' first.")
+        fixtures = [MicroBenchmarks.fixture(rng, db.session.get(User, user_id)) for user_id in user_ids]
+        db.session.remove()
+
+        results = []
+        for name in MicroBenchmarks.cases(fixtures[0]):
+            if only and name not in only:
+                continue
+            latencies, query_counts = [], []
+            for iteration in range(warmup + iterations):
+                call = MicroBenchmarks.cases(fixtures[iteration % len(fixtures)])[name]
+                QueryCounter.start()
+                start = time.perf_counter()
+                call()
+                elapsed = time.perf_counter() - start
+                queries = QueryCounter.stop()
+                db.session.remove()
+                if iteration >= warmup:
+                    latencies.append(elapsed)
+                    query_counts.append(queries)
+            results.append(BenchmarkReport.summarize(name, latencies, query_counts))
+        return results
@@ -0,0 +1,32 @@
+import time
+import random
+
+from culinarycompass.models import User
+from culinarycompass.generate_report import ReportGenerator
+from culinarycompass import db
+
+from benchmarks.results import BenchmarkReport
+
+# Report rendering throughput (sequential reports of sampled users in one process, like one report worker)
+class ReportBenchmark:
+
+    # Method for rendering reports and measuring reports per second (the first report is a warm-up)
+    @staticmethod
+    def run(count, users=20, seed=1):
+        rng = random.Random(seed)
+        usernames = [username for username, in db.session.query(User.username).order_by(User.id)]
+        if not usernames:
+            raise ValueError("The benchmark database has no users, run 'bench seed' first.")
+        usernames = rng.sample(usernames, min(users, len(usernames)))
+
+        ReportGenerator.create_pdf(usernames[0])
+        db.session.remove()
+        latencies = []
+        start = time.perf_counter()
+        for number in range(count):
+            report_start = time.perf_counter()
+            ReportGenerator.create_pdf(usernames[number % len(usernames)])
+            latencies.append(time.perf_counter() - report_start)
+            db.session.remove()
+        elapsed = time.perf_counter() - start
+        return BenchmarkReport.summarize('create_pdf', latencies), count / elapsed
@@ -0,0 +1,97 @@
+import json
+import threading
+from dataclasses import dataclass, asdict
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Latency and query summary of one benchmark (latencies in milliseconds)
+@dataclass
+class BenchmarkResult:
+    name: str
+    samples: int
+    p50: float
+    p95: float
+    p99: float
+    mean: float
+    queries: float = None # mean SQL queries per call (None when they cannot be counted, e.g. against a remote server)
+    errors: int = 0
+
+# Counter of the SQL statements run by the current thread
+class QueryCounter:
+    local = threading.local()
+    installed = False
+
+    # Method for attaching the counter to every engine (once per process)
+    @staticmethod
+    def install():
+        if not QueryCounter.installed:
+            event.listen(Engine, 'before_cursor_execute', count_statement)
+            QueryCounter.installed = True
+
+    # Method for starting a new count on this thread
+    @staticmethod
+    def start():
+        QueryCounter.local.count = 0
+
+    # Method for getting the count since start() on this thread
+    @staticmethod
+    def stop():
+        return getattr(QueryCounter.local, 'count', 0)
+
+# Function to count a statement on the thread that runs it
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    QueryCounter.local.count = getattr(QueryCounter.local, 'count', 0) + 1
+
+# Summaries, output and regression checks of benchmark results
+class BenchmarkReport:
+
+    # Method for summarizing the latencies (seconds) and query counts of one benchmark
+    @staticmethod
+    def summarize(name, latencies, query_counts=None, errors=0):
+        milliseconds = np.array(latencies, dtype=float) * 1000 if latencies else np.zeros(1)
+        p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+        return BenchmarkResult(name=name,
+                               samples=len(latencies),
+                               p50=round(float(p50), 3),
+                               p95=round(float(p95), 3),
+                               p99=round(float(p99), 3),
+                               mean=round(float(milliseconds.mean()), 3),
+                               queries=round(float(np.mean(query_counts)), 2) if query_counts else None,
+                               errors=errors)
+
+    # Method for formatting results as a table
+    @staticmethod
+    def table(results):
+        lines = [f"{'benchmark':<28} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'queries':>8} {'errors':>7}"]
+        for result in results:
+            queries = '-' if result.queries is None else f"{result.queries:g}"
+            lines.append(f"{result.name:<28} {result.samples:>6} {result.p50:>10.2f} {result.p95:>10.2f} "
+                         f"{result.p99:>10.2f} {queries:>8} {result.errors:>7}")
+        return '\n'.join(lines)
+
+    # Method for checking results against thresholds ({name: {"p95_ms": ..., "p99_ms": ..., "queries": ...}})
+    @staticmethod
+    def regressions(results, thresholds):
+        failures = []
+        for result in results:
+            limits = thresholds.get(result.name, {})
+            for metric, value in (('p50_ms', result.p50), ('p95_ms', result.p95), ('p99_ms', result.p99), ('queries', result.queries)):
+                if metric in limits and value is not None and value > limits[metric]:
+                    failures.append(f"{result.name}: {metric} {value:g} > {limits[metric]:g}")
+            if result.errors:
+                failures.append(f"{result.name}: {result.errors} failed requests")
+        return failures
+
+    # Method for loading one section of a thresholds file
+    @staticmethod
+    def load_thresholds(path, section):
+        with open(path) as thresholds_file:
+            return json.load(thresholds_file).get(section, {})
+
+    # Method for writing results as JSON (to compare runs)
+    @staticmethod
+    def write(path, results, **details):
+        with open(path, 'w') as output_file:
+            json.dump(dict(details, results=[asdict(result) for result in results]), output_file, indent=2)
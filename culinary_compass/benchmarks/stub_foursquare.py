@@ -0,0 +1,93 @@
+import json
+import time
+import random
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic_data import SyntheticPlaces, CATEGORIES
+from culinarycompass import app
+
+# Short names of the synthetic categories by id (other requested ids are served as generic restaurants)
+CATEGORY_NAMES = {category_id: short_name for short_name, category_id in CATEGORIES}
+
+# Request handler that answers place searches and matches with deterministic synthetic places
+class StubFoursquareHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0 # seconds added to every response
+
+    # Method for silencing the per-request access log
+    def log_message(self, format, *args):
+        pass
+
+    # Method for answering a GET request (after the configured latency)
+    def do_GET(self):
+        time.sleep(StubFoursquareHandler.latency)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith('/places/search'):
+            body = {'results': [StubFoursquare.select_fields(place, params.get('fields'))
+                                for place in StubFoursquare.search(params)]}
+        elif url.path.endswith('/places/match'):
+            body = {'place': StubFoursquare.select_fields(StubFoursquare.search(dict(params, limit=1))[0], params.get('fields'))}
+        else:
+            self.send_json(404, {'message': 'Not found'})
+            return
+        self.send_json(200, body)
+
+    # Method for sending a JSON response
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+# Local stand-in for the Foursquare Places API (the same search always returns the same places)
+class StubFoursquare:
+    server = None
+
+    # Method for generating the places of a search (places are spread over the requested radius)
+    @staticmethod
+    def search(params):
+        lat, lng = (float(value) for value in params.get('ll', '43.6532,-79.3832').split(','))
+        radius = int(params.get('radius', 5000)) / 1000
+        limit = int(params.get('limit', 10))
+        category_ids = params.get('categories', '').split(',')
+
+        places = []
+        for category_id in category_ids:
+            category = (CATEGORY_NAMES.get(category_id, 'Restaurant'), category_id or '13065')
+            rng = random.Random(f"{params.get('ll')}|{radius}|{category_id}")
+            for number in range(limit):
+                place_lat, place_lng = SyntheticPlaces.random_point(rng, lat, lng, radius)
+                fsq_id = f"stub{rng.getrandbits(48):012x}"
+                places.append(SyntheticPlaces.place(rng, fsq_id, place_lat, place_lng, category))
+        return places[:limit]
+
+    # Method for keeping only the requested fields of a place, like the Foursquare API (all fields if none are given)
+    @staticmethod
+    def select_fields(place, fields):
+        if not fields:
+            return place
+        return {key: value for key, value in place.items() if key in fields.split(',')}
+
+    # Method for starting the server in a background thread on the port of FOURSQUARE_API_URL
+    @staticmethod
+    def start(latency=0.0):
+        StubFoursquareHandler.latency = latency
+        if StubFoursquare.server is None:
+            url = urlparse(app.config['FOURSQUARE_API_URL'])
+            StubFoursquare.server = ThreadingHTTPServer((url.hostname, url.port), StubFoursquareHandler)
+            StubFoursquare.server.daemon_threads = True
+            threading.Thread(target=StubFoursquare.server.serve_forever, daemon=True, name='stub-foursquare').start()
+        return StubFoursquare.server
+
+    # Method for stopping the background server
+    @staticmethod
+    def stop():
+        if StubFoursquare.server is not None:
+            StubFoursquare.server.shutdown()
+            StubFoursquare.server.server_close()
+            StubFoursquare.server = None
@@ -0,0 +1,166 @@
+import math
+from itertools import accumulate
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from culinarycompass.models import User, Restaurant, RestaurantVisit
+from culinarycompass.place_ingest import PlaceIngestor
+from culinarycompass.taste_profile import TasteProfile
+from culinarycompass.restaurant_search import RestaurantSearch
+from culinarycompass.restaurant_location import RestaurantLocation, EARTH_RADIUS_KM
+from culinarycompass import db, bcrypt
+
+# Centre (downtown Toronto) and radius in km of the synthetic city
+CITY_CENTRE = (43.6532, -79.3832)
+CITY_RADIUS = 15
+
+# Password of every synthetic user
+BENCHMARK_PASSWORD = 'benchmark'
+
+# Foursquare categories of the synthetic restaurants (short name, id)
+CATEGORIES = [('Sushi', '13276'), ('Pizza', '13064'), ('Thai', '13352'), ('Café', '13034'),
+              ('Burgers', '13031'), ('Indian', '13199'), ('Mexican', '13303'), ('Italian', '13236'),
+              ('Chinese', '13099'), ('Bakery', '13002'), ('Vegan', '13377'), ('Steakhouse', '13383')]
+
+# Boolean features of the Foursquare payload by section
+ALCOHOL_FEATURES = ['bar_service', 'beer', 'byo', 'cocktails', 'full_bar', 'wine']
+MEAL_FEATURES = ['bar_snacks', 'breakfast', 'brunch', 'lunch', 'happy_hour', 'dessert', 'dinner', 'tasting_menu']
+
+# Rated attributes of the Foursquare payload
+ATTRIBUTES = ['business_meeting', 'clean', 'crowded', 'dates_popular', 'dressy', 'families_popular', 'gluten_free_diet',
+              'good_for_dogs', 'groups_popular', 'healthy_diet', 'late_night', 'noisy', 'quick_bite', 'romantic',
+              'service_quality', 'singles_popular', 'special_occasion', 'trendy', 'value_for_money', 'vegan_diet',
+              'vegetarian_diet']
+ATTRIBUTE_VALUES = ['Poor', 'Average', 'Great']
+
+# Tastes of the synthetic restaurants
+TASTES = ['spicy', 'cozy', 'fresh', 'crispy', 'sweet', 'savory', 'authentic', 'healthy']
+
+# Relative rating frequencies (1 to 5 stars, most visits are rated well)
+RATING_WEIGHTS = [5, 10, 20, 35, 30]
+
+# Rows written per INSERT and users whose profiles are built per transaction
+INSERT_CHUNK_SIZE = 10000
+PROFILE_BATCH_SIZE = 500
+
+# Synthetic Foursquare place payloads (shared by the data generator and the stub server)
+class SyntheticPlaces:
+
+    # Method for getting a random point within a radius (km) of a centre
+    @staticmethod
+    def random_point(rng, lat, lng, radius):
+        distance = radius * math.sqrt(rng.random())
+        bearing = rng.uniform(0, 2 * math.pi)
+        lat_offset = math.degrees(distance * math.cos(bearing) / EARTH_RADIUS_KM)
+        lng_offset = math.degrees(distance * math.sin(bearing) / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 0.01)))
+        return lat + lat_offset, lng + lng_offset
+
+    # Method for generating a place payload in the shape returned by the Foursquare search
+    @staticmethod
+    def place(rng, fsq_id, lat, lng, category=None):
+        short_name, category_id = category or rng.choice(CATEGORIES)
+        name = f"{rng.choice(['The', 'Little', 'Golden', 'Urban', 'Old'])} {short_name} {fsq_id[-4:]}"
+        return {
+            'fsq_id': fsq_id,
+            'name': name,
+            'categories': [{'id': category_id, 'short_name': short_name, 'name': f"{short_name} Restaurant"}],
+            'location': {'formatted_address': f"{rng.randint(1, 999)} {rng.choice(['King', 'Queen', 'Bloor', 'Dundas'])} St"},
+            'geocodes': {'main': {'latitude': round(lat, 6), 'longitude': round(lng, 6)}},
+            'price': rng.randint(1, 4),
+            'tastes': rng.sample(TASTES, 3),
+            'website': f"https://example.com/{fsq_id}",
+            'features': {
+                'food_and_drink': {
+                    'alcohol': {feature: rng.random() < 0.4 for feature in ALCOHOL_FEATURES},
+                    'meals': {feature: rng.random() < 0.5 for feature in MEAL_FEATURES},
+                },
+                'attributes': {attribute: rng.choice(ATTRIBUTE_VALUES) for attribute in ATTRIBUTES if rng.random() < 0.7},
+            },
+        }
+
+# Generator of a synthetic database at a configurable scale (users, restaurants, visits and taste profiles)
+class SyntheticData:
+
+    # Method for dropping and recreating every table and index of the benchmark database
+    @staticmethod
+    def reset():
+        db.drop_all()
+        with db.engine.begin() as connection:
+            for virtual_table in ('restaurant_search', 'restaurant_location'):
+                connection.execute(text(f"DROP TABLE IF EXISTS {virtual_table}"))
+        db.create_all()
+        with db.engine.begin() as connection:
+            RestaurantSearch.create_index(connection)
+            RestaurantLocation.create_index(connection)
+
+    # Method for inserting users (one shared password hash, random questionnaire answers)
+    @staticmethod
+    def generate_users(rng, count):
+        password = bcrypt.generate_password_hash(BENCHMARK_PASSWORD).decode('utf-8')
+        rows = [{'username': f"bench{number}",
+                 'email': f"bench{number}@benchmark.culinarycompass.com",
+                 'password': password,
+                 'vegetarianism': rng.choice(['neither', 'neither', 'neither', 'vegetarian', 'vegan']),
+                 'gluten': rng.random() < 0.1,
+                 'healthy': rng.random() < 0.3,
+                 'no_alcohol': rng.random() < 0.15}
+                for number in range(1, count + 1)]
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            db.session.execute(insert(User), rows[start:start + INSERT_CHUNK_SIZE])
+        db.session.commit()
+        return count
+
+    # Method for ingesting restaurants spread over the city (through the same pipeline as Foursquare results)
+    @staticmethod
+    def generate_restaurants(rng, count):
+        places = []
+        for number in range(1, count + 1):
+            lat, lng = SyntheticPlaces.random_point(rng, *CITY_CENTRE, CITY_RADIUS)
+            places.append(SyntheticPlaces.place(rng, f"bench{number:08d}", lat, lng))
+            if len(places) == 1000:
+                PlaceIngestor.ingest(places)
+                places = []
+        if places:
+            PlaceIngestor.ingest(places)
+        return count
+
+    # Method for inserting visits over the last two years (restaurant popularity follows a long tail)
+    @staticmethod
+    def generate_visits(rng, count):
+        user_ids = [id for id, in db.session.query(User.id)]
+        restaurant_ids = [id for id, in db.session.query(Restaurant.id).order_by(Restaurant.id)]
+        popularity = [1 / (rank + 1) ** 0.8 for rank in range(len(restaurant_ids))]
+        cumulative_popularity = list(accumulate(popularity))
+        now = datetime.utcnow()
+
+        written = 0
+        while written < count:
+            size = min(INSERT_CHUNK_SIZE, count - written)
+            visited = rng.choices(restaurant_ids, cum_weights=cumulative_popularity, k=size)
+            rows = [{'user_id': rng.choice(user_ids),
+                     'restaurant_id': restaurant_id,
+                     'date_visited': now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60)),
+                     'rating': rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0]}
+                    for restaurant_id in visited]
+            db.session.execute(insert(RestaurantVisit), rows)
+            db.session.commit()
+            written += size
+        return written
+
+    # Method for building every user's stored taste profile from their visits
+    @staticmethod
+    def build_profiles():
+        built = 0
+        last_id = 0
+        while True:
+            users = User.query.filter(User.id > last_id).order_by(User.id).limit(PROFILE_BATCH_SIZE).all()
+            if not users:
+                break
+            for user in users:
+                TasteProfile.rebuild(user)
+            db.session.commit()
+            built += len(users)
+            last_id = users[-1].id
+            db.session.expunge_all()
+        return built
@@ -7,6 +7,8 @@ from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 
+from culinarycompass.database import DatabaseConfig, DatabaseRouting, RoutingSession
+
 app = Flask(__name__)
 
 # Load environment variables 
@@ -16,8 +18,26 @@ load_dotenv()
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
 
+# Optional read-only replica for read-heavy pages and reports (reads stay on the primary for a few seconds after a user writes)
+app.config['SQLALCHEMY_REPLICA_URI'] = os.getenv('SQLALCHEMY_REPLICA_URI')
+app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# SQLite settings for several Gunicorn workers (WAL journal, lock wait in ms, sync level and page cache in KiB)
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_CACHE_SIZE'] = int(os.getenv('SQLITE_CACHE_SIZE', 20000))
+
+# Connection pool of server databases such as Postgres (connections per worker, overflow, wait and recycle in seconds)
+app.config['DATABASE_POOL_SIZE'] = int(os.getenv('DATABASE_POOL_SIZE', 5))
+app.config['DATABASE_MAX_OVERFLOW'] = int(os.getenv('DATABASE_MAX_OVERFLOW', 10))
+app.config['DATABASE_POOL_TIMEOUT'] = int(os.getenv('DATABASE_POOL_TIMEOUT', 30))
+app.config['DATABASE_POOL_RECYCLE'] = int(os.getenv('DATABASE_POOL_RECYCLE', 1800))
+
 # Initialize db and bcrypt
-db = SQLAlchemy(app)
+DatabaseConfig.configure(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+DatabaseRouting.install(app)
 bcrypt = Bcrypt(app)
 
 # Login manager
@@ -33,6 +53,83 @@ app.config['MAIL_USERNAME'] = os.getenv('EMAIL_USER')
 app.config['MAIL_PASSWORD'] = os.getenv('EMAIL_PASS')
 mail = Mail(app)
 
+# Report job settings (worker threads started in each app process, 0 leaves jobs to the report-worker command)
+app.config['REPORT_WORKERS'] = int(os.getenv('REPORT_WORKERS', 1))
+app.config['REPORT_MAX_ATTEMPTS'] = int(os.getenv('REPORT_MAX_ATTEMPTS', 3))
+app.config['REPORT_RETRY_DELAY'] = int(os.getenv('REPORT_RETRY_DELAY', 60))
+app.config['REPORT_JOB_TIMEOUT'] = int(os.getenv('REPORT_JOB_TIMEOUT', 600))
+
+# Bulk year-end report settings (worker processes, 0 for one per core, users per statistics query, emails per second
+# over the single SMTP connection and the progress file a crashed run resumes from)
+app.config['BULK_REPORT_PROCESSES'] = int(os.getenv('BULK_REPORT_PROCESSES', 0))
+app.config['BULK_REPORT_BATCH_SIZE'] = int(os.getenv('BULK_REPORT_BATCH_SIZE', 200))
+app.config['BULK_REPORT_SEND_RATE'] = float(os.getenv('BULK_REPORT_SEND_RATE', 5))
+app.config['BULK_REPORT_CHECKPOINT'] = os.getenv('BULK_REPORT_CHECKPOINT', os.path.join(app.instance_path, 'bulk_reports.json'))
+
+# Seconds a My Restaurants visit count is cached in each worker process (the worker that handles a new visit clears it,
+# other workers can show the old count until it expires)
+app.config['HISTORY_COUNT_TTL'] = int(os.getenv('HISTORY_COUNT_TTL', 300))
+
+# Seconds a logged in user's row is cached between requests (updates made through the user's own session are seen
+# straight away, updates made through their other sessions after at most this long)
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))
+
 # API Keys
 google = os.getenv('GOOGLE')
-foursquare = os.getenv('FOURSQUARE')
\ No newline at end of file
+foursquare = os.getenv('FOURSQUARE')
+
+# Foursquare client settings (timeouts in seconds, retries are for connection errors and 429/5xx responses)
+app.config['FOURSQUARE_API_URL'] = os.getenv('FOURSQUARE_API_URL', 'https://api.foursquare.com/v3')
+app.config['FOURSQUARE_CONNECT_TIMEOUT'] = float(os.getenv('FOURSQUARE_CONNECT_TIMEOUT', 3.05))
+app.config['FOURSQUARE_READ_TIMEOUT'] = float(os.getenv('FOURSQUARE_READ_TIMEOUT', 10))
+app.config['FOURSQUARE_RETRIES'] = int(os.getenv('FOURSQUARE_RETRIES', 2))
+app.config['FOURSQUARE_BACKOFF'] = float(os.getenv('FOURSQUARE_BACKOFF', 0.5))
+app.config['FOURSQUARE_BREAKER_THRESHOLD'] = int(os.getenv('FOURSQUARE_BREAKER_THRESHOLD', 5))
+app.config['FOURSQUARE_BREAKER_RESET'] = float(os.getenv('FOURSQUARE_BREAKER_RESET', 30))
+
+# Stored places older than this are refreshed when Foursquare returns them again
+app.config['PLACE_REFRESH_DAYS'] = int(os.getenv('PLACE_REFRESH_DAYS', 30))
+
+# Recommendation search settings (concurrent searches per process, latency budget in seconds,
+# radius in km from which each category is searched in seven smaller sub-areas that cover the circle)
+app.config['RECOMMENDATION_WORKERS'] = int(os.getenv('RECOMMENDATION_WORKERS', 8))
+app.config['RECOMMENDATION_BUDGET'] = float(os.getenv('RECOMMENDATION_BUDGET', 4))
+app.config['RECOMMENDATION_SPLIT_RADIUS'] = int(os.getenv('RECOMMENDATION_SPLIT_RADIUS', 10))
+
+# Stored places of a category within the radius needed to skip its Foursquare search
+app.config['RECOMMENDATION_LOCAL_MIN'] = int(os.getenv('RECOMMENDATION_LOCAL_MIN', 10))
+
+# Instrumentation (per-stage timers, SQL query counts and HTTP timing on /metrics, optional JSON trace logs)
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+app.config['METRICS_LOG_TRACES'] = os.getenv('METRICS_LOG_TRACES', 'false').lower() == 'true'
+
+# Who may read /metrics: requests with `Authorization: Bearer <METRICS_TOKEN>` or from these comma separated client
+# addresses (nobody by default, and behind a reverse proxy every request comes from the proxy's address)
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+app.config['METRICS_ALLOWED_IPS'] = [address.strip() for address in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if address.strip()]
+
+# Directory of the memory-mapped restaurant feature store (built with the build-feature-store command)
+app.config['FEATURE_STORE_PATH'] = os.getenv('FEATURE_STORE_PATH', os.path.join(app.instance_path, 'feature_store'))
+
+# Collaborative filtering settings (neighbours kept per restaurant, share of the ranking score, restaurants per build block)
+app.config['CF_NEIGHBOURS'] = int(os.getenv('CF_NEIGHBOURS', 20))
+app.config['CF_WEIGHT'] = float(os.getenv('CF_WEIGHT', 0.3))
+app.config['CF_BUILD_BLOCK_SIZE'] = int(os.getenv('CF_BUILD_BLOCK_SIZE', 1000))
+
+# Incremental neighbour update settings (seconds new visits are collected before their restaurants are updated together,
+# most recent raters of a restaurant read per update)
+app.config['CF_UPDATE_DELAY'] = float(os.getenv('CF_UPDATE_DELAY', 10))
+app.config['CF_UPDATE_MAX_RATERS'] = int(os.getenv('CF_UPDATE_MAX_RATERS', 500))
+
+# Precomputed recommendation settings (age in hours, tolerance in km, radii in km, users active within the last days)
+app.config['RECOMMENDATION_PRECOMPUTE_MAX_AGE'] = float(os.getenv('RECOMMENDATION_PRECOMPUTE_MAX_AGE', 12))
+app.config['RECOMMENDATION_PRECOMPUTE_TOLERANCE'] = float(os.getenv('RECOMMENDATION_PRECOMPUTE_TOLERANCE', 0.5))
+app.config['RECOMMENDATION_PRECOMPUTE_RADII'] = [int(radius) for radius in os.getenv('RECOMMENDATION_PRECOMPUTE_RADII', '1,5,10').split(',')]
+app.config['RECOMMENDATION_PRECOMPUTE_ACTIVE_DAYS'] = int(os.getenv('RECOMMENDATION_PRECOMPUTE_ACTIVE_DAYS', 7))
+
+# Foursquare search cache settings (backend is 'sqlite' or 'memory', a TTL of 0 disables the cache)
+app.config['FOURSQUARE_CACHE_BACKEND'] = os.getenv('FOURSQUARE_CACHE_BACKEND', 'sqlite')
+app.config['FOURSQUARE_CACHE_PATH'] = os.getenv('FOURSQUARE_CACHE_PATH', os.path.join(app.instance_path, 'search_cache.db'))
+app.config['FOURSQUARE_CACHE_TTL'] = int(os.getenv('FOURSQUARE_CACHE_TTL', 3600))
+app.config['FOURSQUARE_CACHE_MAX_ENTRIES'] = int(os.getenv('FOURSQUARE_CACHE_MAX_ENTRIES', 5000))
+app.config['FOURSQUARE_CACHE_PRECISION'] = int(os.getenv('FOURSQUARE_CACHE_PRECISION', 6))
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import smtplib
+from datetime import datetime
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+
+from culinarycompass.models import User, RestaurantVisit
+from culinarycompass.report_stats import ReportStatsQuery
+from culinarycompass.generate_report import ReportGenerator
+from culinarycompass.report_template import ReportTemplate
+from culinarycompass.report_jobs import report_message
+from culinarycompass.database import DatabaseRouting
+from culinarycompass import app, db, mail
+
+# Mail errors that only affect one recipient (the run records the user as failed and carries on)
+RECIPIENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)
+
+# Mail errors after which the connection is opened again and the email is resent once
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError)
+
+# Function to render one report in a worker process (returns the user id with the PDF, or with the error)
+def render_report(user_id, stats, year):
+    try:
+        return user_id, ReportGenerator.render_pdf(stats, year), None
+    except Exception as e:
+        return user_id, None, str(e)
+
+# Progress of a bulk report run (saved after every report, so a crashed run resumes after the last user it finished)
+@dataclass
+class BulkReportCheckpoint:
+    year: int
+    last_user_id: int = 0
+    sent: int = 0
+    failed: list = field(default_factory=list) # (user id, error) pairs
+    complete: bool = False
+
+    # Method for loading the checkpoint of a year (a new checkpoint if there is none or it is for another year)
+    @staticmethod
+    def load(path, year):
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                checkpoint = BulkReportCheckpoint(**json.load(checkpoint_file))
+            if checkpoint.year == year:
+                return checkpoint
+        return BulkReportCheckpoint(year)
+
+    # Method for saving the checkpoint (written to a temporary file and renamed, so a crash never leaves half a file)
+    def save(self, path):
+        if not path:
+            return
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(self.__dict__, checkpoint_file)
+        os.replace(temporary_path, path)
+
+# Email sending over a single SMTP connection, at most `rate` emails per second
+class ReportMailer:
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_send = 0
+        self.connection = None
+
+    def __enter__(self):
+        self.connection = mail.connect().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.connection.__exit__(exc_type, exc_value, tb)
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    # Method for waiting for the next send slot of the rate limit
+    def throttle(self):
+        now = time.monotonic()
+        if now < self.next_send:
+            time.sleep(self.next_send - now)
+        self.next_send = max(now, self.next_send) + self.interval
+
+    # Method for emailing a report (reconnects once if the server dropped the connection)
+    def send(self, pdf_bytes, email, filename):
+        msg = report_message(pdf_bytes, email, filename)
+        self.throttle()
+        try:
+            self.connection.send(msg)
+        except RECONNECT_ERRORS:
+            self.connection.host = self.connection.configure_host()
+            self.connection.send(msg)
+
+# Year-end reports for every user: statistics are queried in batches, PDFs are rendered in a process pool and the
+# emails are sent in user order from this process
+class BulkReports:
+
+    # Method for getting the next batch of users after a user id (keyset pagination, so resuming is one index seek)
+    @staticmethod
+    def next_users(after_user_id, batch_size, year, usernames=None, active_only=False):
+        query = db.session.query(User.id, User.username, User.email).filter(User.id > after_user_id)
+        if usernames:
+            query = query.filter(User.username.in_(usernames))
+        if active_only:
+            year_start, year_end = ReportStatsQuery.year_range(year)
+            query = query.filter(db.session.query(RestaurantVisit.id)
+                                 .filter(RestaurantVisit.user_id == User.id)
+                                 .filter(RestaurantVisit.date_visited >= year_start)
+                                 .filter(RestaurantVisit.date_visited < year_end)
+                                 .exists())
+        return query.order_by(User.id).limit(batch_size).all()
+
+    # Method for querying a batch's statistics and submitting its reports to the pool
+    @staticmethod
+    def submit(executor, users, year):
+        with DatabaseRouting.replica():
+            all_stats = ReportStatsQuery.for_users([user.id for user in users], year)
+        db.session.remove()
+        return [(user, executor.submit(render_report, user.id, all_stats[user.id], year)) for user in users]
+
+    # Method for generating and delivering the reports (deliver(user, pdf_bytes) is called in user id order)
+    @staticmethod
+    def run(deliver, checkpoint, checkpoint_path=None, processes=None, batch_size=None, usernames=None,
+            active_only=False, progress=None):
+        processes = processes or app.config['BULK_REPORT_PROCESSES'] or os.cpu_count()
+        batch_size = batch_size or app.config['BULK_REPORT_BATCH_SIZE']
+        year = checkpoint.year
+        start = time.perf_counter()
+        done = 0
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=ReportTemplate.register_fonts) as executor:
+            users = BulkReports.next_users(checkpoint.last_user_id, batch_size, year, usernames, active_only)
+            pending = BulkReports.submit(executor, users, year) if users else []
+            while pending:
+                # The pool renders the next batch while this one is being sent
+                users = BulkReports.next_users(pending[-1][0].id, batch_size, year, usernames, active_only)
+                next_pending = BulkReports.submit(executor, users, year) if users else []
+
+                for user, future in pending:
+                    user_id, pdf_bytes, error = future.result()
+                    if error is None:
+                        try:
+                            deliver(user, pdf_bytes)
+                            checkpoint.sent += 1
+                        except RECIPIENT_ERRORS as e:
+                            error = str(e)
+                    if error is not None:
+                        checkpoint.failed.append((user_id, error))
+                    checkpoint.last_user_id = user_id
+                    checkpoint.save(checkpoint_path)
+                    done += 1
+
+                if progress:
+                    progress(checkpoint, done / (time.perf_counter() - start))
+                pending = next_pending
+
+        checkpoint.complete = True
+        checkpoint.save(checkpoint_path)
+        elapsed = time.perf_counter() - start
+        return done, done / elapsed if elapsed else 0.0
+
+    # Method for the year to report on (the previous year in January, when year-end reports are usually sent)
+    @staticmethod
+    def default_year():
+        today = datetime.now()
+        return today.year - 1 if today.month == 1 else today.year
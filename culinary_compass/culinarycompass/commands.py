@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import click
+import statistics
+import subprocess
+from datetime import datetime
+from sqlalchemy import inspect, delete, select, func, tuple_
+from sqlalchemy.orm import selectinload
+
+from culinarycompass.models import User, Restaurant, RestaurantVisit, RestaurantFeature
+from culinarycompass.taste_profile import TasteProfile
+from culinarycompass.recommendation_data import RecommendationData, MIN_RATING
+from culinarycompass.report_stats import ReportStatsQuery
+from culinarycompass.recommendation_scoring import RestaurantScorer
+from culinarycompass.search_cache import search_cache
+from culinarycompass.restaurant_search import RestaurantSearch
+from culinarycompass.restaurant_location import RestaurantLocation
+from culinarycompass.report_jobs import ReportWorkerPool
+from culinarycompass.bulk_reports import BulkReports, BulkReportCheckpoint, ReportMailer
+from culinarycompass.precomputed_recommendations import PrecomputedRecommendations
+from culinarycompass.foursquare_client import FoursquareUnavailable
+from culinarycompass.item_neighbours import ItemNeighbours
+from culinarycompass.feature_store import FeatureStore
+from culinarycompass import app, db
+
+# Libraries that web workers should only load on first use (reports and offline rebuilds)
+LAZY_MODULES = ['matplotlib', 'reportlab', 'scipy', 'sklearn']
+
+# Script run in a fresh interpreter to measure the import of the app (as Gunicorn does with run:app)
+STARTUP_PROBE = """
+import sys, time, json, resource
+start = time.perf_counter()
+import run
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'modules': sorted({name.split('.')[0] for name in sys.modules})}))
+"""
+
+# Command for upgrading an existing database (creates new tables, new nullable columns and new indexes)
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                    click.echo(f"Added column {table.name}.{column.name}")
+
+        # Keep the first feature row of each restaurant before the unique index is created
+        existing_indexes = {index['name'] for index in inspector.get_indexes('restaurant_feature')}
+        if 'ix_restaurant_feature_restaurant_id' not in existing_indexes:
+            result = connection.execute(delete(RestaurantFeature).where(RestaurantFeature.id.not_in(
+                select(func.min(RestaurantFeature.id)).group_by(RestaurantFeature.restaurant_id))))
+            if result.rowcount:
+                click.echo(f"Removed {result.rowcount} duplicate restaurant feature rows")
+
+        for table in db.metadata.sorted_tables:
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    click.echo(f"Created index {index.name}")
+
+        if RestaurantSearch.create_index(connection):
+            click.echo("Created full-text search index restaurant_search")
+        if RestaurantLocation.create_index(connection):
+            click.echo("Created spatial index restaurant_location")
+    click.echo("Database is up to date.")
+
+# Command for checking that the hot queries use indexes (SQLite EXPLAIN QUERY PLAN) and the virtual indexes are in sync
+@app.cli.command('check-indexes')
+def check_indexes():
+    if db.engine.dialect.name != 'sqlite':
+        click.echo("check-indexes only supports SQLite.")
+        return
+
+    year_start, year_end = ReportStatsQuery.year_range(datetime.now().year)
+    hot_queries = {
+        'recommender visits': RestaurantVisit.query.filter(RestaurantVisit.user_id == 1, RestaurantVisit.rating >= MIN_RATING),
+        'report year range': RestaurantVisit.query.filter(RestaurantVisit.user_id == 1,
+                                                          RestaurantVisit.date_visited >= year_start,
+                                                          RestaurantVisit.date_visited < year_end),
+        'my restaurants': RestaurantVisit.query.filter_by(user_id=1)
+            .filter(tuple_(RestaurantVisit.date_visited, RestaurantVisit.id) < tuple_(year_end, 1))
+            .order_by(RestaurantVisit.date_visited.desc(), RestaurantVisit.id.desc()),
+        'restaurant features': RestaurantFeature.query.filter_by(restaurant_id='fsq_id'),
+        'history search': RestaurantSearch.filter_visits(RestaurantVisit.query.filter_by(user_id=1), 'sushi')[0],
+        'nearby restaurants': RestaurantLocation.box_query(43.65, -79.38, 5),
+    }
+
+    full_scans = 0
+    for name, query in hot_queries.items():
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        details = [row[-1] for row in plan]
+        # A plain SCAN of a table (without USING INDEX) reads every row, virtual tables report their own index
+        scans = [detail for detail in details if detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE INDEX' not in detail]
+        full_scans += len(scans)
+        click.echo(f"{'FULL SCAN' if scans else 'ok'}: {name}: {'; '.join(details)}")
+
+    # The virtual indexes must match the restaurant table (rows are joined by restaurant.index_key)
+    connection = db.session.connection()
+    drifted = 0
+    for name, index, trigger in (('restaurant_search', RestaurantSearch, 'restaurant_search_insert'),
+                                 ('restaurant_location', RestaurantLocation, 'restaurant_location_insert')):
+        if RestaurantSearch.trigger_outdated(connection, trigger):
+            drifted += 1
+            click.echo(f"DRIFT: {name} triggers are missing or keyed by rowid, run upgrade-db to rebuild it")
+            continue
+        drift = index.drift(connection)
+        drifted += drift
+        click.echo(f"{'DRIFT' if drift else 'ok'}: {name}: {drift} rows out of sync with the restaurant table"
+                   f"{', run rebuild-search' if drift else ''}")
+    if full_scans or drifted:
+        raise SystemExit(1)
+
+# Command for rebuilding the full-text search and spatial indexes from the restaurant table
+@app.cli.command('rebuild-search')
+def rebuild_search():
+    if not RestaurantSearch.available():
+        click.echo("The full-text search and spatial indexes are only used with SQLite.")
+        return
+    with db.engine.begin() as connection:
+        for index in (RestaurantSearch, RestaurantLocation):
+            if not index.create_index(connection):
+                index.rebuild(connection)
+    click.echo("Rebuilt the full-text search and spatial indexes.")
+
+# Command for encoding the feature vectors of restaurants saved before vectors were stored
+@app.cli.command('encode-features')
+@click.option('--batch-size', default=500, help='Restaurants encoded per transaction.')
+def encode_features(batch_size):
+    encoded = 0
+    while True:
+        restaurants = Restaurant.query \
+            .options(selectinload(Restaurant.features)) \
+            .filter(Restaurant.feature_vector.is_(None)) \
+            .limit(batch_size) \
+            .all()
+        if not restaurants:
+            break
+        for restaurant in restaurants:
+            restaurant.feature_vector = RestaurantScorer.encode(RecommendationData.first_features(restaurant))
+        db.session.commit()
+        encoded += len(restaurants)
+    click.echo(f"Encoded {encoded} restaurant feature vectors.")
+
+# Command for rebuilding every user's taste profile from their visit history (backfill)
+@app.cli.command('rebuild-profiles')
+def rebuild_profiles():
+    users = User.query.all()
+    for user in users:
+        TasteProfile.rebuild(user)
+    db.session.commit()
+    click.echo(f"Rebuilt {len(users)} taste profiles.")
+
+# Command for checking every stored taste profile against a full recomputation
+@app.cli.command('check-profiles')
+def check_profiles():
+    inconsistent = 0
+    for user in User.query.all():
+        mismatches = TasteProfile.check(user)
+        if mismatches:
+            inconsistent += 1
+            click.echo(f"{user.username}: {', '.join(mismatches)}")
+    click.echo(f"{inconsistent} inconsistent taste profiles.")
+    if inconsistent:
+        raise SystemExit(1)
+
+# Command for showing the Foursquare search cache size and hit rate
+@app.cli.command('cache-stats')
+@click.option('--clear', is_flag=True, help='Empty the cache after showing its stats.')
+def cache_stats(clear):
+    stats = search_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / lookups if lookups else 0.0
+    click.echo(f"{stats['backend']} cache: {stats['entries']} entries, {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.1%} hit rate)")
+    if clear:
+        search_cache.backend.clear()
+        click.echo("Cleared the cache.")
+
+# Command for running report workers in the foreground (for deployments with REPORT_WORKERS set to 0)
+@app.cli.command('report-worker')
+@click.option('--threads', default=1, help='Number of worker threads.')
+def report_worker(threads):
+    click.echo(f"Processing report jobs with {threads} thread(s).")
+    ReportWorkerPool.start(threads)
+    for thread in ReportWorkerPool.threads:
+        thread.join()
+
+# Command for generating and emailing the year-end reports of all (or some) users, resuming an interrupted run
+@app.cli.command('send-year-end-reports')
+@click.option('--year', default=None, type=int, help='Year to report on (default: this year, or last year in January).')
+@click.option('--user', 'usernames', multiple=True, help='Only report on these usernames (repeatable).')
+@click.option('--active-only', is_flag=True, help='Skip users without visits in the year.')
+@click.option('--processes', default=None, type=int, help='Worker processes rendering reports (default: one per core).')
+@click.option('--batch-size', default=None, type=int, help='Users per statistics query.')
+@click.option('--rate', default=None, type=float, help='Emails sent per second (0 for no limit).')
+@click.option('--checkpoint', default=None, help='Progress file (default: BULK_REPORT_CHECKPOINT).')
+@click.option('--restart', is_flag=True, help='Ignore the progress of an earlier run of the year.')
+@click.option('--output-dir', default=None, help='Write the PDFs to this directory instead of emailing them.')
+def send_year_end_reports(year, usernames, active_only, processes, batch_size, rate, checkpoint, restart, output_dir):
+    year = BulkReports.default_year() if year is None else year
+    rate = app.config['BULK_REPORT_SEND_RATE'] if rate is None else rate
+    checkpoint_path = checkpoint or app.config['BULK_REPORT_CHECKPOINT']
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+
+    progress = BulkReportCheckpoint(year) if restart else BulkReportCheckpoint.load(checkpoint_path, year)
+    if progress.complete:
+        click.echo(f"The {year} reports were already sent ({progress.sent} sent, {len(progress.failed)} failed). "
+                   f"Use --restart to send them again.")
+        return
+    if progress.last_user_id:
+        click.echo(f"Resuming the {year} reports after user {progress.last_user_id} ({progress.sent} already sent).")
+
+    def show_progress(checkpoint, reports_per_second):
+        click.echo(f"Up to user {checkpoint.last_user_id}: {checkpoint.sent} sent, {len(checkpoint.failed)} failed, "
+                   f"{reports_per_second:.1f} reports/s")
+
+    options = dict(checkpoint_path=checkpoint_path, processes=processes, batch_size=batch_size, usernames=usernames,
+                   active_only=active_only, progress=show_progress)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+        def write_pdf(user, pdf_bytes):
+            with open(os.path.join(output_dir, f"{user.username}.pdf"), 'wb') as pdf_file:
+                pdf_file.write(pdf_bytes)
+
+        count, reports_per_second = BulkReports.run(write_pdf, progress, **options)
+    else:
+        with ReportMailer(rate) as mailer:
+            count, reports_per_second = BulkReports.run(
+                lambda user, pdf_bytes: mailer.send(pdf_bytes, user.email, f"{user.username}.pdf"), progress, **options)
+
+    click.echo(f"Generated {count} reports in this run ({reports_per_second:.1f} reports/s). "
+               f"{year} total: {progress.sent} sent, {len(progress.failed)} failed.")
+    for user_id, error in progress.failed:
+        click.echo(f"FAILED: user {user_id}: {error}")
+
+# Command for precomputing the recommendations of recently active users (run on a schedule, e.g. cron)
+@app.cli.command('precompute-recommendations')
+@click.option('--days', default=None, type=int, help='Users who asked for recommendations within this many days.')
+@click.option('--radii', default=None, help='Comma separated search radii in km.')
+def precompute_recommendations(days, radii):
+    days = app.config['RECOMMENDATION_PRECOMPUTE_ACTIVE_DAYS'] if days is None else days
+    radii = app.config['RECOMMENDATION_PRECOMPUTE_RADII'] if radii is None else [int(radius) for radius in radii.split(',')]
+
+    active_users = PrecomputedRecommendations.active_users(days)
+    stored = 0
+    for user_id, coords in active_users.items():
+        try:
+            stored += PrecomputedRecommendations.precompute(user_id, coords, radii)
+        except FoursquareUnavailable as e:
+            click.echo(f"Stopped early, Foursquare is unavailable: {e}")
+            break
+    click.echo(f"Stored {stored} recommendation lists for {len(active_users)} active users.")
+
+# Command for rebuilding the collaborative filtering neighbour lists from all ratings (visits added later update them incrementally)
+@app.cli.command('build-neighbours')
+@click.option('--k', default=None, type=int, help='Neighbours kept per restaurant.')
+def build_neighbours(k):
+    restaurants, stored = ItemNeighbours.build(k)
+    click.echo(f"Stored {stored} neighbours for {restaurants} restaurants.")
+
+# Command for exporting the restaurant feature vectors to a new version of the memory-mapped feature store
+@app.cli.command('build-feature-store')
+def build_feature_store():
+    version, count = FeatureStore.build()
+    click.echo(f"Built feature store version {version} with {count} restaurants.")
+
+# Command for checking the worker startup budget (import time, peak memory and no heavy libraries loaded at import)
+@app.cli.command('check-startup')
+@click.option('--runs', default=3, help='Fresh interpreters to measure (the median is reported).')
+@click.option('--max-seconds', default=2.0, help='Import time budget in seconds.')
+@click.option('--max-rss', default=100, help='Peak memory budget in MB.')
+def check_startup(runs, max_seconds, max_rss):
+    measurements = []
+    for attempt in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=os.path.dirname(app.root_path),
+                                capture_output=True, text=True, check=True).stdout
+        measurements.append(json.loads(output.strip().splitlines()[-1]))
+
+    seconds = statistics.median(measurement['seconds'] for measurement in measurements)
+    rss_mb = statistics.median(measurement['rss_mb'] for measurement in measurements)
+    loaded = sorted({module for measurement in measurements for module in measurement['modules']} & set(LAZY_MODULES))
+    click.echo(f"Import time {seconds:.3f}s (budget {max_seconds}s), peak memory {rss_mb:.0f} MB (budget {max_rss} MB)")
+    failures = []
+    if seconds > max_seconds:
+        failures.append("import time is over budget")
+    if rss_mb > max_rss:
+        failures.append("peak memory is over budget")
+    if loaded:
+        failures.append(f"loaded at import: {', '.join(loaded)}")
+    for failure in failures:
+        click.echo(f"FAILED: {failure}")
+    if failures:
+        raise SystemExit(1)
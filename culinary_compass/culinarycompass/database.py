@@ -0,0 +1,105 @@
+import time
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+# Bind key of the optional read-only replica
+REPLICA_BIND = 'replica'
+
+# Flask session key holding the time of the user's last write (their reads stay on the primary for a while after it)
+LAST_WRITE_KEY = 'db_last_write'
+
+# Whether reads in the current context may go to the replica
+use_replica = ContextVar('use_replica', default=False)
+
+# Engine settings from the app config (SQLite pragmas, server pool sizing and read replica routing)
+class DatabaseConfig:
+    sqlite_pragmas = []
+
+    # Method for building the engine options of a database URI
+    @staticmethod
+    def engine_options(uri, config):
+        if not uri or make_url(uri).get_backend_name() == 'sqlite':
+            # Flask-SQLAlchemy picks the SQLite pool, so only the lock wait is set here (the pragmas are set on connect)
+            return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+        return {
+            'pool_size': config['DATABASE_POOL_SIZE'],
+            'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+            'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+            'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+            # Test connections before use, so workers recover from database restarts and dropped idle connections
+            'pool_pre_ping': True,
+        }
+
+    # Method for setting the engine options, the replica bind and the SQLite pragmas (call before creating the extension)
+    @staticmethod
+    def configure(app):
+        config = app.config
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = DatabaseConfig.engine_options(config['SQLALCHEMY_DATABASE_URI'], config)
+        if config['SQLALCHEMY_REPLICA_URI']:
+            replica_options = DatabaseConfig.engine_options(config['SQLALCHEMY_REPLICA_URI'], config)
+            config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: dict(replica_options, url=config['SQLALCHEMY_REPLICA_URI'])}
+
+        # WAL lets readers run while a worker writes, NORMAL sync is safe with WAL and a negative cache size is in KiB
+        DatabaseConfig.sqlite_pragmas = [
+            f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}",
+            f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}",
+            f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+            f"PRAGMA cache_size = -{int(config['SQLITE_CACHE_SIZE'])}",
+        ]
+        if not event.contains(Engine, 'connect', set_sqlite_pragmas):
+            event.listen(Engine, 'connect', set_sqlite_pragmas)
+
+# Function to set the pragmas on every new SQLite connection of the app's engines
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in DatabaseConfig.sqlite_pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+# Session that sends reads to the replica inside DatabaseRouting.replica() blocks (writes always go to the primary)
+class RoutingSession(Session):
+
+    # Method for choosing the engine of a statement
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and use_replica.get() and not self._flushing and getattr(clause, 'is_select', False):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# Read routing for read-heavy pages and reports
+class DatabaseRouting:
+    sticky_seconds = 0
+
+    # Method for reading from the replica in a block (the user's own recent writes are read from the primary)
+    @staticmethod
+    @contextmanager
+    def replica():
+        recent_write = has_request_context() and time.time() - session.get(LAST_WRITE_KEY, 0) < DatabaseRouting.sticky_seconds
+        token = use_replica.set(not recent_write)
+        try:
+            yield
+        finally:
+            use_replica.reset(token)
+
+    # Method for installing the session hook that records the time of each request's writes
+    @staticmethod
+    def install(app):
+        DatabaseRouting.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        if app.config['SQLALCHEMY_REPLICA_URI'] and not event.contains(RoutingSession, 'after_flush', record_write):
+            event.listen(RoutingSession, 'after_flush', record_write)
+
+# Function to remember when the current user last wrote (reads of the next few seconds skip the replica, which may lag)
+def record_write(db_session, flush_context):
+    if has_request_context():
+        session[LAST_WRITE_KEY] = time.time()
@@ -0,0 +1,117 @@
+import os
+import json
+import threading
+from datetime import datetime
+from dataclasses import dataclass
+
+import numpy as np
+
+from culinarycompass.models import Restaurant
+from culinarycompass.recommendation_scoring import RestaurantScorer, FEATURE_NAMES
+from culinarycompass import app, db
+
+# Name of the file that points at the current version (replaced atomically on rebuild)
+CURRENT_FILE = 'CURRENT'
+
+# Restaurants read from the database per batch while exporting
+EXPORT_BATCH_SIZE = 5000
+
+# A loaded version of the store (both arrays are read-only memory maps, so every worker shares the same pages)
+@dataclass
+class FeatureSnapshot:
+    version: str
+    built_at: datetime
+    ids: np.ndarray # sorted restaurant ids
+    matrix: np.ndarray # float32 feature vectors, one row per id
+
+    # Method for getting the row of each id (-1 if the id is not in this version)
+    def positions(self, restaurant_ids):
+        if not len(self.ids) or not restaurant_ids:
+            return np.full(len(restaurant_ids), -1)
+        wanted = np.array(restaurant_ids, dtype=self.ids.dtype)
+        positions = np.minimum(np.searchsorted(self.ids, wanted), len(self.ids) - 1)
+        return np.where(self.ids[positions] == wanted, positions, -1)
+
+# Versioned on-disk store of the restaurant feature vectors shared by all app processes
+class FeatureStore:
+    snapshot = None
+    snapshot_key = None
+    lock = threading.Lock()
+
+    # Method for getting the path of a file in the store directory
+    @staticmethod
+    def path(name):
+        return os.path.join(app.config['FEATURE_STORE_PATH'], name)
+
+    # Method for getting the current version (reloaded when a rebuild has swapped it, None if there is no store)
+    @staticmethod
+    def current():
+        try:
+            stat = os.stat(FeatureStore.path(CURRENT_FILE))
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        with FeatureStore.lock:
+            if FeatureStore.snapshot_key != key:
+                with open(FeatureStore.path(CURRENT_FILE)) as current_file:
+                    current = json.load(current_file)
+                FeatureStore.snapshot = FeatureSnapshot(
+                    version=current['version'],
+                    built_at=datetime.fromisoformat(current['built_at']),
+                    ids=np.load(FeatureStore.path(f"ids-{current['version']}.npy"), mmap_mode='r')[:current['count']],
+                    matrix=np.load(FeatureStore.path(f"features-{current['version']}.npy"), mmap_mode='r')[:current['count']])
+                FeatureStore.snapshot_key = key
+            return FeatureStore.snapshot
+
+    # Method for exporting every encoded restaurant vector as a new version and switching to it
+    @staticmethod
+    def build():
+        os.makedirs(app.config['FEATURE_STORE_PATH'], exist_ok=True)
+        built_at = datetime.utcnow()
+        version = built_at.strftime('%Y%m%d%H%M%S%f')
+        count = Restaurant.query.filter(Restaurant.feature_vector.isnot(None)).count()
+        id_length = max(db.session.query(db.func.max(db.func.length(Restaurant.id))).scalar() or 1, 1)
+
+        # Write both arrays straight to disk in id order (rows are never held in memory all at once)
+        ids = np.lib.format.open_memmap(FeatureStore.path(f"ids-{version}.npy"), mode='w+',
+                                        dtype=f'S{id_length}', shape=(count,))
+        matrix = np.lib.format.open_memmap(FeatureStore.path(f"features-{version}.npy"), mode='w+',
+                                           dtype=np.float32, shape=(count, len(FEATURE_NAMES)))
+        row = 0
+        last_id = None
+        while row < count:
+            batch = db.session.query(Restaurant.id, Restaurant.feature_vector) \
+                .filter(Restaurant.feature_vector.isnot(None))
+            if last_id is not None:
+                batch = batch.filter(Restaurant.id > last_id)
+            batch = batch.order_by(Restaurant.id).limit(EXPORT_BATCH_SIZE).all()
+            if not batch:
+                break
+            batch = batch[:count - row]
+            for restaurant_id, feature_vector in batch:
+                ids[row] = restaurant_id.encode()
+                matrix[row] = RestaurantScorer.decode(feature_vector)
+                row += 1
+            last_id = batch[-1][0]
+
+        # Lookups binary search the ids, so fix the order if the database collation differs from byte order
+        if row > 1 and not np.all(ids[:row - 1] <= ids[1:row]):
+            order = np.argsort(ids[:row], kind='stable')
+            ids[:row] = ids[:row][order]
+            matrix[:row] = matrix[:row][order]
+        ids.flush()
+        matrix.flush()
+        del ids, matrix
+
+        # Point readers at the new version (os.replace is atomic) and remove versions older than the previous one
+        temporary_path = FeatureStore.path(f"{CURRENT_FILE}.{version}")
+        with open(temporary_path, 'w') as current_file:
+            json.dump({'version': version, 'built_at': built_at.isoformat(), 'count': row}, current_file)
+        previous = FeatureStore.current()
+        os.replace(temporary_path, FeatureStore.path(CURRENT_FILE))
+        keep = {version} | ({previous.version} if previous is not None else set())
+        for name in os.listdir(app.config['FEATURE_STORE_PATH']):
+            if name.endswith('.npy') and name.split('-', 1)[1][:-len('.npy')] not in keep:
+                os.remove(FeatureStore.path(name))
+        return version, row
@@ -0,0 +1,113 @@
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from culinarycompass.metrics import Metrics
+from culinarycompass import app, foursquare
+
+# Error raised when the Foursquare API cannot be reached (or the circuit breaker is open)
+class FoursquareUnavailable(Exception):
+    pass
+
+# Circuit breaker that fails fast after repeated failures until a cooldown has passed
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    # Method for checking if a call may go through (one trial call is let through after the cooldown)
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+# Shared Foursquare Places API client (pooled keep-alive session with timeouts and retries)
+class FoursquareClient:
+
+    def __init__(self, api_key, base_url, timeout, retries, backoff, breaker, pool_size=10):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.breaker = breaker
+
+        # Retry connection errors and 429/5xx responses with exponential backoff
+        retry = Retry(total=retries,
+                      backoff_factor=backoff,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'],
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            "accept": "application/json",
+            "Authorization": api_key
+        })
+
+    # Method for creating the client from the app config
+    @staticmethod
+    def from_config(config, api_key):
+        breaker = CircuitBreaker(config['FOURSQUARE_BREAKER_THRESHOLD'], config['FOURSQUARE_BREAKER_RESET'])
+        return FoursquareClient(api_key,
+                                config['FOURSQUARE_API_URL'],
+                                (config['FOURSQUARE_CONNECT_TIMEOUT'], config['FOURSQUARE_READ_TIMEOUT']),
+                                config['FOURSQUARE_RETRIES'],
+                                config['FOURSQUARE_BACKOFF'],
+                                breaker)
+
+    # Method for making a GET request and returning the response (raises FoursquareUnavailable on failure)
+    def get(self, path, params):
+        if not self.breaker.allow():
+            raise FoursquareUnavailable('Foursquare circuit breaker is open')
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}/{path}", params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            if Metrics.enabled():
+                Metrics.observe_http(path, 'error', time.perf_counter() - start)
+            raise FoursquareUnavailable(str(e)) from e
+        if Metrics.enabled():
+            Metrics.observe_http(path, response.status_code, time.perf_counter() - start)
+
+        # Only server errors and rate limiting count as the API being down
+        if response.status_code == 429 or response.status_code >= 500:
+            self.breaker.record_failure()
+            raise FoursquareUnavailable(f"Foursquare returned {response.status_code}")
+        self.breaker.record_success()
+        return response
+
+    # Method for matching a single place by name and coordinates (places/match)
+    def match_place(self, name, coords, fields):
+        return self.get('places/match', {'name': name, 'll': coords, 'fields': fields})
+
+    # Method for searching places around coordinates (places/search)
+    def search_places(self, coords, radius, categories, limit, fields):
+        return self.get('places/search', {'ll': coords, 'radius': radius, 'categories': categories, 'limit': limit, 'fields': fields})
+
+foursquare_client = FoursquareClient.from_config(app.config, foursquare)
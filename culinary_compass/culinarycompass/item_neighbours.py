@@ -0,0 +1,214 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import func, delete, insert, select, tuple_
+
+from culinarycompass.models import RestaurantVisit, RestaurantNeighbour
+from culinarycompass import app, db
+
+# Rating that counts as neutral when scoring neighbours (higher ratings pull neighbours up, lower ratings push them down)
+NEUTRAL_RATING = 3
+
+# Largest distance of a rating from the neutral rating (scales the collaborative score to -1..1)
+MAX_RATING_DEVIATION = 2
+
+# Rows written per INSERT when storing neighbour lists
+NEIGHBOUR_INSERT_CHUNK_SIZE = 5000
+
+# Item-item collaborative filtering over the user x restaurant rating matrix (cosine similarity of rating columns)
+class ItemNeighbours:
+    executor = None
+    lock = threading.Lock()
+    pending = set() # restaurants rated since the last update run
+    scheduled = False
+
+    # Method for building the query of average ratings per user and restaurant (repeat visits count once)
+    @staticmethod
+    def ratings_query():
+        return db.session.query(RestaurantVisit.user_id,
+                                RestaurantVisit.restaurant_id,
+                                func.avg(RestaurantVisit.rating).label('rating')) \
+            .group_by(RestaurantVisit.user_id, RestaurantVisit.restaurant_id)
+
+    # Method for getting the k most similar columns of each row of a similarity block (excluding the row itself)
+    @staticmethod
+    def top_neighbours(block, row_offset, k):
+        neighbours = []
+        for row in range(block.shape[0]):
+            start, end = block.indptr[row], block.indptr[row + 1]
+            columns, similarities = block.indices[start:end], block.data[start:end]
+            keep = (columns != row_offset + row) & (similarities > 0)
+            columns, similarities = columns[keep], similarities[keep]
+            if len(columns) > k:
+                best = np.argpartition(-similarities, k - 1)[:k]
+                columns, similarities = columns[best], similarities[best]
+            neighbours.append((columns, similarities))
+        return neighbours
+
+    # Method for rebuilding every restaurant's neighbour list from all ratings (bounded memory: one block of rows at a time)
+    @staticmethod
+    def build(k=None, block_size=None):
+        k = app.config['CF_NEIGHBOURS'] if k is None else k
+        block_size = app.config['CF_BUILD_BLOCK_SIZE'] if block_size is None else block_size
+        # SciPy is only needed by the offline rebuild, so it is not loaded into web workers
+        from scipy.sparse import csr_matrix, diags
+        ratings = ItemNeighbours.ratings_query().all()
+
+        # Sparse restaurant x user rating matrix with unit length rows
+        user_index, restaurant_index = {}, {}
+        rows, columns, values = [], [], []
+        for user_id, restaurant_id, rating in ratings:
+            rows.append(restaurant_index.setdefault(restaurant_id, len(restaurant_index)))
+            columns.append(user_index.setdefault(user_id, len(user_index)))
+            values.append(rating)
+        restaurant_ids = list(restaurant_index)
+        matrix = csr_matrix((np.array(values, dtype=np.float32), (rows, columns)),
+                            shape=(len(restaurant_index), len(user_index)))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        matrix = (diags(1 / np.maximum(norms, 1e-12)) @ matrix).tocsr()
+        matrix_t = matrix.T.tocsr()
+
+        db.session.execute(delete(RestaurantNeighbour))
+        stored = 0
+        for block_start in range(0, matrix.shape[0], block_size):
+            # Cosine similarities of this block of restaurants with every restaurant (only co-rated pairs are non-zero)
+            block = (matrix[block_start:block_start + block_size] @ matrix_t).tocsr()
+            neighbour_rows = []
+            for offset, (neighbour_columns, similarities) in enumerate(ItemNeighbours.top_neighbours(block, block_start, k)):
+                restaurant_id = restaurant_ids[block_start + offset]
+                neighbour_rows.extend({'restaurant_id': restaurant_id,
+                                       'neighbour_id': restaurant_ids[column],
+                                       'similarity': float(similarity)}
+                                      for column, similarity in zip(neighbour_columns, similarities))
+            for chunk_start in range(0, len(neighbour_rows), NEIGHBOUR_INSERT_CHUNK_SIZE):
+                db.session.execute(insert(RestaurantNeighbour), neighbour_rows[chunk_start:chunk_start + NEIGHBOUR_INSERT_CHUNK_SIZE])
+            stored += len(neighbour_rows)
+        db.session.commit()
+        return len(restaurant_ids), stored
+
+    # Method for updating the neighbours of a restaurant after it is rated (only its rating column changes)
+    @staticmethod
+    def update_restaurant(restaurant_id, k=None, max_raters=None):
+        k = app.config['CF_NEIGHBOURS'] if k is None else k
+        max_raters = app.config['CF_UPDATE_MAX_RATERS'] if max_raters is None else max_raters
+
+        # Ratings of every restaurant visited by the most recent raters of this one (a sample for popular restaurants)
+        raters = ItemNeighbours.ratings_query() \
+            .filter(RestaurantVisit.restaurant_id == restaurant_id) \
+            .order_by(func.max(RestaurantVisit.id).desc()) \
+            .limit(max_raters) \
+            .subquery()
+        co_ratings = ItemNeighbours.ratings_query() \
+            .filter(RestaurantVisit.user_id.in_(select(raters.c.user_id))) \
+            .all()
+        rater_ratings = {user_id: rating for user_id, rated_id, rating in co_ratings if rated_id == restaurant_id}
+        if not rater_ratings:
+            return 0
+
+        dots = {}
+        for user_id, rated_id, rating in co_ratings:
+            if rated_id != restaurant_id:
+                dots[rated_id] = dots.get(rated_id, 0.0) + rating * rater_ratings[user_id]
+
+        # Column norms and rater counts of the co-rated restaurants (over all of their raters)
+        user_ratings = ItemNeighbours.ratings_query() \
+            .filter(RestaurantVisit.restaurant_id.in_(list(dots) + [restaurant_id])) \
+            .subquery()
+        norms, rater_counts = {}, {}
+        for rated_id, total, count in db.session.query(user_ratings.c.restaurant_id,
+                                                       func.sum(user_ratings.c.rating * user_ratings.c.rating),
+                                                       func.count()) \
+                .group_by(user_ratings.c.restaurant_id):
+            norms[rated_id], rater_counts[rated_id] = float(total) ** 0.5, count
+
+        # Dot products over a sample of the raters are scaled up to estimate the dot products over all of them
+        scale = rater_counts[restaurant_id] / len(rater_ratings)
+        similarities = {rated_id: min(1.0, dot * scale / (norms[restaurant_id] * norms[rated_id]))
+                        for rated_id, dot in dots.items() if norms.get(rated_id)}
+
+        # Replace this restaurant's list and its entry in every co-rated restaurant's list
+        best = sorted(similarities.items(), key=lambda item: (-item[1], item[0]))[:k]
+        db.session.execute(delete(RestaurantNeighbour).where(RestaurantNeighbour.restaurant_id == restaurant_id))
+        db.session.execute(delete(RestaurantNeighbour).where(RestaurantNeighbour.neighbour_id == restaurant_id))
+        rows = [{'restaurant_id': restaurant_id, 'neighbour_id': rated_id, 'similarity': similarity} for rated_id, similarity in best]
+        rows += [{'restaurant_id': rated_id, 'neighbour_id': restaurant_id, 'similarity': similarity}
+                 for rated_id, similarity in similarities.items()]
+        for chunk_start in range(0, len(rows), NEIGHBOUR_INSERT_CHUNK_SIZE):
+            db.session.execute(insert(RestaurantNeighbour), rows[chunk_start:chunk_start + NEIGHBOUR_INSERT_CHUNK_SIZE])
+        ItemNeighbours.trim(list(similarities), k)
+        db.session.commit()
+        return len(best)
+
+    # Method for cutting the neighbour lists of restaurants back to the k most similar
+    @staticmethod
+    def trim(restaurant_ids, k):
+        ranked = db.session.query(RestaurantNeighbour.restaurant_id,
+                                  RestaurantNeighbour.neighbour_id,
+                                  func.row_number().over(partition_by=RestaurantNeighbour.restaurant_id,
+                                                         order_by=(RestaurantNeighbour.similarity.desc(), RestaurantNeighbour.neighbour_id))
+                                  .label('position')) \
+            .filter(RestaurantNeighbour.restaurant_id.in_(restaurant_ids)) \
+            .subquery()
+        extra = db.session.query(ranked.c.restaurant_id, ranked.c.neighbour_id).filter(ranked.c.position > k).all()
+        if extra:
+            db.session.execute(delete(RestaurantNeighbour).where(
+                tuple_(RestaurantNeighbour.restaurant_id, RestaurantNeighbour.neighbour_id).in_([tuple(row) for row in extra])))
+
+    # Method for updating a restaurant's neighbours in the background after a visit is added (visits within
+    # CF_UPDATE_DELAY are collected, so a restaurant rated many times in a row is only updated once)
+    @staticmethod
+    def schedule_update(restaurant_id):
+        with ItemNeighbours.lock:
+            ItemNeighbours.pending.add(restaurant_id)
+            if ItemNeighbours.scheduled:
+                return
+            ItemNeighbours.scheduled = True
+            if ItemNeighbours.executor is None:
+                # One writer thread, so updates do not compete for the database
+                ItemNeighbours.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='item-neighbours')
+        ItemNeighbours.executor.submit(ItemNeighbours.run_pending)
+
+    # Method for updating the restaurants collected during the delay (visits added meanwhile schedule the next run)
+    @staticmethod
+    def run_pending():
+        time.sleep(app.config['CF_UPDATE_DELAY'])
+        with ItemNeighbours.lock:
+            restaurant_ids = ItemNeighbours.pending
+            ItemNeighbours.pending = set()
+            ItemNeighbours.scheduled = False
+        for restaurant_id in sorted(restaurant_ids):
+            ItemNeighbours.run_update(restaurant_id)
+
+    # Method for running a scheduled update in its own app context
+    @staticmethod
+    def run_update(restaurant_id):
+        with app.app_context():
+            try:
+                ItemNeighbours.update_restaurant(restaurant_id)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Item neighbour update error")
+            finally:
+                db.session.remove()
+
+    # Method for scoring candidate restaurants by the user's ratings of their neighbours (-1 to 1, 0 without neighbours)
+    @staticmethod
+    def scores(user_id, candidate_ids):
+        if not candidate_ids:
+            return np.zeros(0, dtype=np.float32)
+
+        # One query: candidates' neighbour rows joined with the user's average rating of each neighbour
+        user_ratings = ItemNeighbours.ratings_query().filter(RestaurantVisit.user_id == user_id).subquery()
+        rows = db.session.query(RestaurantNeighbour.neighbour_id,
+                                func.sum(RestaurantNeighbour.similarity * (user_ratings.c.rating - NEUTRAL_RATING)),
+                                func.sum(RestaurantNeighbour.similarity)) \
+            .join(user_ratings, user_ratings.c.restaurant_id == RestaurantNeighbour.restaurant_id) \
+            .filter(RestaurantNeighbour.neighbour_id.in_(candidate_ids)) \
+            .group_by(RestaurantNeighbour.neighbour_id) \
+            .all()
+
+        weighted = {candidate_id: weighted_sum / (similarity_sum * MAX_RATING_DEVIATION)
+                    for candidate_id, weighted_sum, similarity_sum in rows if similarity_sum}
+        return np.array([weighted.get(candidate_id, 0.0) for candidate_id in candidate_ids], dtype=np.float32)
@@ -0,0 +1,232 @@
+import hmac
+import json
+import time
+import logging
+import threading
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from culinarycompass import app
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Upper bounds of the queries per request histogram buckets
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200]
+
+# Help text of each exported metric
+METRIC_HELP = {
+    'culinarycompass_request_seconds': ('histogram', 'Request latency by endpoint.'),
+    'culinarycompass_request_queries': ('histogram', 'SQL queries per request by endpoint.'),
+    'culinarycompass_stage_seconds': ('histogram', 'Latency of each recommendation pipeline stage.'),
+    'culinarycompass_http_seconds': ('histogram', 'Latency of external HTTP requests by path and status.'),
+    'culinarycompass_sql_queries_total': ('counter', 'SQL queries executed.'),
+}
+
+# Logger for the structured per-request traces (one JSON object per line)
+trace_logger = logging.getLogger('culinarycompass.trace')
+
+# Timer for one stage (records into the stage histogram and the current request's trace)
+class StageTimer:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        Metrics.observe('culinarycompass_stage_seconds', {'stage': self.name}, elapsed, LATENCY_BUCKETS)
+        Metrics.add_to_trace('stages', {'stage': self.name, 'ms': round(elapsed * 1000, 3)})
+        return False
+
+# Timer used while metrics are disabled (does nothing)
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+# In-process metrics registry exported in the Prometheus text format (each worker process reports its own values)
+class Metrics:
+    counters = {} # {(name, labels): value}
+    histograms = {} # {(name, labels): [bucket counts, sum, count, buckets]}
+    lock = threading.Lock()
+    trace_lock = threading.Lock()
+    trace_local = threading.local() # trace of the request a thread pool task was started from
+    installed = False
+
+    # Method for checking if instrumentation is on
+    @staticmethod
+    def enabled():
+        return app.config['METRICS_ENABLED']
+
+    # Method for checking if the current request may read /metrics (a matching bearer token or an allowed client address)
+    @staticmethod
+    def authorized():
+        token = app.config['METRICS_TOKEN']
+        header = request.headers.get('Authorization', '')
+        if token and header.startswith('Bearer ') and hmac.compare_digest(header[len('Bearer '):].encode(), token.encode()):
+            return True
+        return request.remote_addr in app.config['METRICS_ALLOWED_IPS']
+
+    # Method for timing a pipeline stage (a shared no-op timer when metrics are disabled)
+    @staticmethod
+    def stage(name):
+        if not app.config['METRICS_ENABLED']:
+            return NULL_TIMER
+        return StageTimer(name)
+
+    # Method for adding to a counter
+    @staticmethod
+    def increment(name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with Metrics.lock:
+            Metrics.counters[key] = Metrics.counters.get(key, 0) + amount
+
+    # Method for recording a value in a histogram
+    @staticmethod
+    def observe(name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with Metrics.lock:
+            histogram = Metrics.histograms.get(key)
+            if histogram is None:
+                histogram = Metrics.histograms[key] = [[0] * len(buckets), 0.0, 0, buckets]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    # Method for recording an external HTTP request
+    @staticmethod
+    def observe_http(path, status, elapsed):
+        Metrics.observe('culinarycompass_http_seconds', {'path': path, 'status': str(status)}, elapsed, LATENCY_BUCKETS)
+        Metrics.add_to_trace('http', {'path': path, 'status': status, 'ms': round(elapsed * 1000, 3)})
+
+    # Method for getting the current request's trace (in a thread pool task, the trace passed to run_traced)
+    @staticmethod
+    def current_trace():
+        if has_request_context():
+            return g.get('trace')
+        return getattr(Metrics.trace_local, 'trace', None)
+
+    # Method for running a thread pool task under a request's trace (captured with current_trace in the request thread)
+    @staticmethod
+    def run_traced(trace, function, *args):
+        Metrics.trace_local.trace = trace
+        try:
+            return function(*args)
+        finally:
+            Metrics.trace_local.trace = None
+
+    # Method for adding an entry to a list of the current trace, or to its query count (tasks write concurrently)
+    @staticmethod
+    def add_to_trace(key, entry=None):
+        trace = Metrics.current_trace()
+        if trace is None:
+            return
+        with Metrics.trace_lock:
+            if entry is None:
+                trace[key] += 1
+            else:
+                trace[key].append(entry)
+
+    # Method for formatting metric labels
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs]
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    # Method for rendering every metric in the Prometheus text exposition format
+    @staticmethod
+    def render():
+        with Metrics.lock:
+            counters = dict(Metrics.counters)
+            histograms = {key: [list(value[0]), value[1], value[2], value[3]] for key, value in Metrics.histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (metric_name, labels), value in sorted(counters.items()):
+                if metric_name == name:
+                    lines.append(f"{name}{Metrics.format_labels(labels)} {value}")
+            for (metric_name, labels), (bucket_counts, total, count, buckets) in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                for bound, bucket_count in zip(buckets, bucket_counts):
+                    lines.append(f"{name}_bucket{Metrics.format_labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{Metrics.format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{Metrics.format_labels(labels)} {total}")
+                lines.append(f"{name}_count{Metrics.format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    # Method for clearing every recorded value
+    @staticmethod
+    def reset():
+        with Metrics.lock:
+            Metrics.counters.clear()
+            Metrics.histograms.clear()
+
+    # Method for installing the SQL query hook (only when metrics are enabled, so there is no cost otherwise)
+    @staticmethod
+    def install():
+        if Metrics.installed or not app.config['METRICS_ENABLED']:
+            return
+        event.listen(Engine, 'before_cursor_execute', count_query)
+        if app.config['METRICS_LOG_TRACES'] and not trace_logger.handlers:
+            trace_logger.addHandler(logging.StreamHandler())
+            trace_logger.setLevel(logging.INFO)
+        Metrics.installed = True
+
+# Function to count every SQL statement (and the current request's statements)
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    Metrics.increment('culinarycompass_sql_queries_total')
+    Metrics.add_to_trace('queries')
+
+# Start a request trace
+@app.before_request
+def start_trace():
+    if not app.config['METRICS_ENABLED']:
+        return
+    g.trace = {'start': time.perf_counter(), 'queries': 0, 'stages': [], 'http': []}
+
+# Record the request metrics and optionally log the trace
+@app.after_request
+def finish_trace(response):
+    if not app.config['METRICS_ENABLED'] or 'trace' not in g:
+        return response
+    # Searches that outlived the latency budget can still add to the popped trace, their entries are not logged
+    trace = g.pop('trace')
+    with Metrics.trace_lock:
+        trace = dict(trace, stages=list(trace['stages']), http=list(trace['http']))
+    elapsed = time.perf_counter() - trace['start']
+    endpoint = request.endpoint or 'unknown'
+    Metrics.observe('culinarycompass_request_seconds',
+                    {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)},
+                    elapsed, LATENCY_BUCKETS)
+    Metrics.observe('culinarycompass_request_queries', {'endpoint': endpoint}, trace['queries'], QUERY_BUCKETS)
+
+    if app.config['METRICS_LOG_TRACES']:
+        trace_logger.info(json.dumps({'endpoint': endpoint,
+                                      'method': request.method,
+                                      'status': response.status_code,
+                                      'ms': round(elapsed * 1000, 3),
+                                      'queries': trace['queries'],
+                                      'stages': trace['stages'],
+                                      'http': trace['http']}))
+    return response
+
+Metrics.install()
@@ -1,13 +1,8 @@
 from datetime import datetime
 from itsdangerous import URLSafeTimedSerializer as Serializer
-from culinarycompass import db, login_manager, app
+from culinarycompass import db, app
 from flask_login import UserMixin
 
-# Load user callback for flask-login
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
 # User model
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -20,6 +15,7 @@ class User(db.Model, UserMixin):
     healthy = db.Column(db.Boolean, default=False)
     no_alcohol = db.Column(db.Boolean, default=False)
     restaurant_visits = db.relationship('RestaurantVisit', backref='user', lazy=True)
+    profile = db.relationship('UserProfile', backref='user', lazy=True, uselist=False)
 
     # Generate a password reset token
     def get_reset_token(self):
@@ -52,9 +48,22 @@ class Restaurant(db.Model):
     price = db.Column(db.Integer)
     description = db.Column(db.Text)
     tastes = db.Column(db.Text, nullable=True)
+    feature_vector = db.Column(db.LargeBinary, nullable=True) # float32 attribute vector, encoded at ingest
+    date_updated = db.Column(db.DateTime, nullable=True) # When the place data was last fetched from Foursquare
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    # Stable integer key of the SQLite full-text and spatial index rows (set by a trigger, the rowid of a table with a
+    # text primary key can change on VACUUM)
+    index_key = db.Column(db.Integer, nullable=True)
     restaurant_visits = db.relationship('RestaurantVisit', backref='restaurant', lazy=True)
     features = db.relationship('RestaurantFeature', backref='restaurant', lazy=True)
 
+    # Coordinate index for radius lookups on databases without the SQLite R*Tree index
+    __table_args__ = (
+        db.Index('ix_restaurant_lat_lng', 'latitude', 'longitude'),
+        db.Index('ix_restaurant_index_key', 'index_key', unique=True),
+    )
+
     def __repr__(self):
         return f"Restaurant('{self.name}', '{self.address}')"
 
@@ -103,6 +112,11 @@ class RestaurantFeature(db.Model):
     value_for_money = db.Column(db.String(200))
     vegan_diet = db.Column(db.String(200))
     vegetarian_diet = db.Column(db.String(200))
+
+    # Features are always looked up by restaurant (at most one row per restaurant)
+    __table_args__ = (
+        db.Index('ix_restaurant_feature_restaurant_id', 'restaurant_id', unique=True),
+    )
     
     def get_all_data(self):
         return {
@@ -150,6 +164,81 @@ class RestaurantVisit(db.Model):
     restaurant_id = db.Column(db.String(200), db.ForeignKey('restaurant.id'), nullable=False)
     date_visited = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     rating = db.Column(db.Integer, nullable=False)
+
+    # Indexes for the visit history (/my), report year ranges, recommender rating filters, history search joins
+    # and the restaurant raters used by the collaborative filtering updates
+    __table_args__ = (
+        db.Index('ix_restaurant_visit_user_date', 'user_id', 'date_visited'),
+        db.Index('ix_restaurant_visit_user_rating', 'user_id', 'rating'),
+        db.Index('ix_restaurant_visit_user_restaurant', 'user_id', 'restaurant_id'),
+        db.Index('ix_restaurant_visit_restaurant_user', 'restaurant_id', 'user_id', 'rating'),
+    )
     
     def __repr__(self):
-        return f"Restaurant Visit('{self.user_id}', '{self.date_visited}', '{self.rating}')"
\ No newline at end of file
+        return f"Restaurant Visit('{self.user_id}', '{self.date_visited}', '{self.rating}')"
+
+# Restaurant neighbour model (top-k most similar restaurants by the ratings of users who visited both)
+class RestaurantNeighbour(db.Model):
+    restaurant_id = db.Column(db.String(24), db.ForeignKey('restaurant.id'), primary_key=True)
+    neighbour_id = db.Column(db.String(24), db.ForeignKey('restaurant.id'), primary_key=True)
+    similarity = db.Column(db.Float, nullable=False)
+
+    # Covering index for scoring candidates (neighbour) against the restaurants a user rated
+    __table_args__ = (
+        db.Index('ix_restaurant_neighbour_neighbour', 'neighbour_id', 'restaurant_id', 'similarity'),
+    )
+
+    def __repr__(self):
+        return f"Restaurant Neighbour('{self.restaurant_id}', '{self.neighbour_id}', '{self.similarity}')"
+
+# User taste profile model (running totals of the user's well rated visits)
+class UserProfile(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category_counts = db.Column(db.JSON, nullable=False, default=dict)
+    attribute_sums = db.Column(db.JSON, nullable=False, default=dict)
+    restaurant_count = db.Column(db.Integer, nullable=False, default=0)
+    preferred_attributes = db.Column(db.JSON, nullable=False, default=dict)
+    date_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"User Profile('{self.user_id}', '{self.restaurant_count}')"
+
+# Precomputed recommendation model (latest ranked restaurants of a user for one search radius)
+class PrecomputedRecommendation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    radius = db.Column(db.Integer, nullable=False) # km
+    restaurant_ids = db.Column(db.JSON, nullable=False, default=list) # best first
+    date_computed = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_used = db.Column(db.DateTime, nullable=True) # When the user last asked for recommendations at this radius
+
+    # One list per user and radius (the most recent location)
+    __table_args__ = (
+        db.Index('ix_precomputed_recommendation_user_radius', 'user_id', 'radius', unique=True),
+    )
+
+    def __repr__(self):
+        return f"Precomputed Recommendation('{self.user_id}', '{self.radius}', '{self.date_computed}')"
+
+# Report job model (queue of year-end reports to render and email)
+class ReportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, sent or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # A user can only have one job in progress (de-duplicates repeated clicks)
+    __table_args__ = (
+        db.Index('ix_report_job_active_user', 'user_id', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    def __repr__(self):
+        return f"Report Job('{self.user_id}', '{self.status}', '{self.attempts}')"
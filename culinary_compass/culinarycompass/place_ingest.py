@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from culinarycompass.models import Restaurant, RestaurantFeature
+from culinarycompass.recommendation_scoring import RestaurantScorer
+from culinarycompass.restaurant_location import RestaurantLocation
+from culinarycompass.taste_profile import TasteProfile
+from culinarycompass import app, db
+
+# Feature names based on the RestaurantFeature model columns (computed once)
+FEATURE_COLUMNS = {column.name for column in RestaurantFeature.__table__.columns} - {'id', 'restaurant_id'}
+
+# Feature sections of the Foursquare payload that are not stored
+IGNORE_SECTIONS = ['payment', 'services', 'amenities']
+
+# Bound parameters per INSERT statement (under the limits of SQLite 3.32+ and Postgres, rows per chunk follow from it)
+UPSERT_MAX_PARAMETERS = 30000
+
+# Restaurant columns that are kept when an existing row is refreshed
+KEEP_ON_REFRESH = ['id', 'full_name', 'index_key']
+
+# Feature columns that are kept when an existing feature row is refreshed
+KEEP_FEATURES_ON_REFRESH = ['id', 'restaurant_id']
+
+# Model defaults of the feature columns (every feature row sets every column, so an upsert also clears old values)
+FEATURE_DEFAULTS = {column.name: column.default.arg if column.default is not None else None
+                    for column in RestaurantFeature.__table__.columns if column.name in FEATURE_COLUMNS}
+
+# Shared pipeline for saving Foursquare place payloads as restaurants and features
+class PlaceIngestor:
+
+    # Method to flatten nested JSON structures
+    @staticmethod
+    def flatten_features(data, prefix=""):
+        if data is None:
+            return {}
+
+        flat_data = {}
+        for key, value in data.items():
+            if key in IGNORE_SECTIONS:
+                continue
+            if isinstance(value, dict):
+                flat_data.update(PlaceIngestor.flatten_features(value, f"{prefix}{key}_"))
+            else:
+                flat_data[key] = value
+        return flat_data
+
+    # Method for getting the feature column values of a place
+    @staticmethod
+    def feature_values(place_data):
+        flattened_features = PlaceIngestor.flatten_features(place_data.get('features'))
+        return {feature_name: feature_data for feature_name, feature_data in flattened_features.items()
+                if feature_name in FEATURE_COLUMNS}
+
+    # Method for getting the restaurant column values of a place (names can be overridden, e.g. from Google)
+    @staticmethod
+    def restaurant_values(place_data, feature_values, full_name=None, name=None):
+        categories = [f"{category['short_name']}:{category['id']}" for category in place_data.get('categories', [])]
+        tastes = place_data.get('tastes')
+        latitude, longitude = RestaurantLocation.place_coordinates(place_data)
+        name = name or place_data.get('name') or full_name
+        return {
+            'id': place_data['fsq_id'],
+            'full_name': full_name or name,
+            'name': name,
+            'address': place_data['location']['formatted_address'],
+            'category': ",".join(categories),
+            'website': place_data.get('website'),
+            'menu': place_data.get('menu'),
+            'price': place_data.get('price'),
+            'description': place_data.get('description'),
+            'tastes': ",".join(tastes) if tastes else None,
+            'latitude': latitude,
+            'longitude': longitude,
+            # Encode the feature vector once at ingest
+            'feature_vector': RestaurantScorer.encode_values(feature_values),
+            'date_updated': datetime.utcnow()
+        }
+
+    # Method for building an insert statement that updates the existing row on a conflict of the unique column
+    @staticmethod
+    def upsert_statement(table, rows, conflict_column='id', keep=KEEP_ON_REFRESH):
+        dialect_name = db.engine.dialect.name
+        if dialect_name == 'sqlite':
+            statement = sqlite.insert(table).values(rows)
+        elif dialect_name == 'postgresql':
+            statement = postgresql.insert(table).values(rows)
+        else:
+            return None
+
+        update_columns = {column.name: statement.excluded[column.name]
+                          for column in table.columns if column.name not in keep}
+        return statement.on_conflict_do_update(index_elements=[table.c[conflict_column]], set_=update_columns)
+
+    # Method for splitting rows into chunks that stay under the bound parameter limit
+    @staticmethod
+    def chunks(rows):
+        size = max(1, UPSERT_MAX_PARAMETERS // max((len(row) for row in rows), default=1))
+        return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+    # Method for getting the stored category and features of restaurants that are about to be refreshed
+    @staticmethod
+    def stored_values(stored_categories):
+        stored = {id: (category, {}) for id, category in stored_categories.items()}
+        if stored:
+            columns = [RestaurantFeature.__table__.c[name] for name in sorted(FEATURE_COLUMNS)]
+            for row in db.session.query(RestaurantFeature.restaurant_id, *columns) \
+                    .filter(RestaurantFeature.restaurant_id.in_(stored.keys())):
+                stored[row.restaurant_id][1].update({name: getattr(row, name) for name in FEATURE_COLUMNS})
+        return stored
+
+    # Method for saving a batch of place payloads (new places are inserted, stale places are refreshed, and the ids
+    # of the places that are stored afterwards are returned)
+    @staticmethod
+    def ingest(places, names=None):
+        names = names or {}
+        places_by_id = {}
+        for place_data in places:
+            # A place needs a name, from the payload or from the names given for its id
+            fsq_id = place_data.get('fsq_id')
+            if fsq_id and (place_data.get('name') or any(names.get(fsq_id, ()))) and 'location' in place_data:
+                places_by_id[fsq_id] = place_data
+        if not places_by_id:
+            return []
+
+        # Single IN lookup for the places that are already stored (fresh ones are skipped, stale ones are refreshed)
+        refresh_before = datetime.utcnow() - timedelta(days=app.config['PLACE_REFRESH_DAYS'])
+        fresh_ids = set()
+        stale_categories = {}
+        for id, category, date_updated in db.session.query(Restaurant.id, Restaurant.category, Restaurant.date_updated) \
+                .filter(Restaurant.id.in_(places_by_id.keys())):
+            if date_updated is not None and date_updated >= refresh_before:
+                fresh_ids.add(id)
+            else:
+                stale_categories[id] = category
+
+        restaurant_rows = []
+        feature_rows = []
+        for fsq_id, place_data in list(places_by_id.items()):
+            if fsq_id in fresh_ids:
+                continue
+            try:
+                feature_values = PlaceIngestor.feature_values(place_data)
+                full_name, name = names.get(fsq_id, (None, None))
+                restaurant_rows.append(PlaceIngestor.restaurant_values(place_data, feature_values, full_name, name))
+            except (KeyError, TypeError, AttributeError, ValueError):
+                # Skip a malformed place instead of failing the whole batch
+                del places_by_id[fsq_id]
+                continue
+
+            # Only create a feature row if the place has feature values
+            if feature_values:
+                feature_rows.append(dict(feature_values, restaurant_id=fsq_id))
+
+        if restaurant_rows:
+            written_ids = [row['id'] for row in restaurant_rows]
+            stored = PlaceIngestor.stored_values(stale_categories)
+
+            # Multi-row upserts in chunks to stay under the bound parameter limit
+            for chunk in PlaceIngestor.chunks(restaurant_rows):
+                statement = PlaceIngestor.upsert_statement(Restaurant.__table__, chunk)
+                if statement is not None:
+                    db.session.execute(statement)
+                else:
+                    for row in chunk:
+                        db.session.merge(Restaurant(**row))
+
+            # Upsert the feature rows on the unique restaurant index (missing columns get the model defaults), so
+            # concurrent ingests of the same place do not race, and drop the rows of places that lost their features
+            feature_ids = {row['restaurant_id'] for row in feature_rows}
+            featureless_ids = [id for id in written_ids if id not in feature_ids]
+            if featureless_ids:
+                db.session.execute(delete(RestaurantFeature).where(RestaurantFeature.restaurant_id.in_(featureless_ids)))
+            feature_rows = [dict(FEATURE_DEFAULTS, **row) for row in feature_rows]
+            for chunk in PlaceIngestor.chunks(feature_rows):
+                statement = PlaceIngestor.upsert_statement(RestaurantFeature.__table__, chunk, 'restaurant_id', KEEP_FEATURES_ON_REFRESH)
+                if statement is not None:
+                    db.session.execute(statement)
+                else:
+                    db.session.execute(delete(RestaurantFeature).where(RestaurantFeature.restaurant_id.in_(
+                        [row['restaurant_id'] for row in chunk])))
+                    db.session.execute(insert(RestaurantFeature), chunk)
+
+            # Move the stored taste profiles of users who rated refreshed restaurants to the new categories and features
+            features_by_id = {row['restaurant_id']: row for row in feature_rows}
+            changes = {}
+            for row in restaurant_rows:
+                if row['id'] in stored:
+                    new = (row['category'], features_by_id.get(row['id'], {}))
+                    if TasteProfile.profile_values(*stored[row['id']]) != TasteProfile.profile_values(*new):
+                        changes[row['id']] = (stored[row['id']], new)
+            TasteProfile.refresh_restaurants(changes)
+            db.session.commit()
+        return list(places_by_id.keys())
@@ -0,0 +1,166 @@
+import math
+import time
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from culinarycompass.search_cache import search_cache
+from culinarycompass.foursquare_client import foursquare_client, FoursquareUnavailable
+from culinarycompass.place_ingest import PlaceIngestor
+from culinarycompass.restaurant_location import RestaurantLocation
+from culinarycompass.metrics import Metrics
+from culinarycompass import app
+
+# Place fields requested from the Foursquare search
+SEARCH_FIELDS = "name,fsq_id,categories,menu,website,price,tastes,features,location,geocodes,description"
+
+# Places requested per search (the Foursquare maximum)
+SEARCH_LIMIT = 50
+
+# Kilometres per degree of latitude
+KM_PER_DEGREE = 111.32
+
+# Sub-areas of a split search on a ring around the centre (six circles of radius r/2 at r*cos(30°), with the
+# centre circle of radius r/2, cover a circle of radius r exactly)
+SPLIT_RING_AREAS = 6
+
+# Factor applied to the sub-area radius, so places on the edges between sub-areas are found by both searches
+SPLIT_OVERLAP = 1.05
+
+# Outcome of a local search (searches that missed the latency budget or failed are left out of the results)
+@dataclass
+class PlaceSearchResult:
+    restaurant_ids: list
+    local: int = 0 # restaurants served from the local corpus
+    searches: int = 0
+    completed: int = 0
+    failed: int = 0
+    elapsed: float = 0.0 # seconds
+
+    @property
+    def complete(self):
+        return self.completed == self.searches
+
+# Concurrent Foursquare searches (one per category and sub-area) merged into one candidate list
+class PlaceSearch:
+    executor = None
+    lock = threading.Lock()
+
+    # Method for getting the shared thread pool that runs the searches (created once per process)
+    @staticmethod
+    def get_executor():
+        with PlaceSearch.lock:
+            if PlaceSearch.executor is None:
+                PlaceSearch.executor = ThreadPoolExecutor(max_workers=app.config['RECOMMENDATION_WORKERS'],
+                                                          thread_name_prefix='place-search')
+            return PlaceSearch.executor
+
+    # Method for splitting a large search area into a centre circle and a ring of overlapping circles that together
+    # cover the whole area (radius in km)
+    @staticmethod
+    def sub_areas(coords, radius):
+        if radius < app.config['RECOMMENDATION_SPLIT_RADIUS']:
+            return [(coords, radius)]
+
+        try:
+            lat, lng = (float(value) for value in coords.split(','))
+        except (AttributeError, ValueError):
+            return [(coords, radius)]
+        area_radius = radius * math.sin(math.pi / SPLIT_RING_AREAS) * SPLIT_OVERLAP
+        distance = radius * math.cos(math.pi / SPLIT_RING_AREAS)
+        km_per_degree_lng = KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        areas = [(coords, area_radius)]
+        for number in range(SPLIT_RING_AREAS):
+            bearing = 2 * math.pi * number / SPLIT_RING_AREAS
+            area_lat = lat + distance * math.cos(bearing) / KM_PER_DEGREE
+            area_lng = lng + distance * math.sin(bearing) / km_per_degree_lng
+            areas.append((f"{area_lat:.6f},{area_lng:.6f}", area_radius))
+        return areas
+
+    # Method for searching one category in one area (runs in the thread pool, so it only uses the cache and the API)
+    @staticmethod
+    def search(coords, category_id, radius):
+        cache_key = search_cache.key(coords, [category_id], radius)
+        parsed_data = search_cache.get(cache_key)
+        if parsed_data is None:
+            response = foursquare_client.search_places(coords, int(radius * 1000), category_id, SEARCH_LIMIT, SEARCH_FIELDS)
+            # Raises ValueError for a body that is not JSON or not a list of places (so it is never cached)
+            parsed_data = response.json()
+            PlaceSearch.results(parsed_data)
+            if response.ok:
+                search_cache.set(cache_key, parsed_data)
+        return PlaceSearch.results(parsed_data)
+
+    # Method for getting the places of a search response (raises ValueError if the payload is malformed)
+    @staticmethod
+    def results(parsed_data):
+        if not isinstance(parsed_data, dict):
+            raise ValueError("Foursquare response is not a JSON object")
+        results = parsed_data.get('results') or []
+        if not isinstance(results, list):
+            raise ValueError("Foursquare results are not a list")
+        return [place for place in results if isinstance(place, dict)]
+
+    # Method for merging search results in priority order (first occurrence of each place wins)
+    @staticmethod
+    def merge(result_lists):
+        places = {}
+        for results in result_lists:
+            for place in results:
+                if place.get('fsq_id'):
+                    places.setdefault(place['fsq_id'], place)
+        return list(places.values())
+
+    # Method for searching the user's top categories around the coordinates within the latency budget
+    @staticmethod
+    def search_local(coords, top_categories, radius, budget=None):
+        budget = app.config['RECOMMENDATION_BUDGET'] if budget is None else budget
+        start = time.monotonic()
+
+        # Stored places within the radius come first, Foursquare is only searched for categories with too few of them
+        category_ids = [category_id for category_name, category_id in top_categories]
+        with Metrics.stage('nearby_lookup'):
+            nearby = RestaurantLocation.nearby(coords, radius, category_ids)
+        local_ids = list(dict.fromkeys(restaurant_id for category_id in category_ids for restaurant_id in nearby[category_id]))
+        gap_category_ids = [category_id for category_id in category_ids
+                            if len(nearby[category_id]) < app.config['RECOMMENDATION_LOCAL_MIN']]
+
+        # One search per missing category (most visited first) and sub-area, recorded in the request's trace
+        executor = PlaceSearch.get_executor()
+        trace = Metrics.current_trace()
+        futures = [executor.submit(Metrics.run_traced, trace, PlaceSearch.search, area_coords, category_id, area_radius)
+                   for category_id in gap_category_ids
+                   for area_coords, area_radius in PlaceSearch.sub_areas(coords, radius)]
+
+        # Searches still running when the budget runs out keep going in the background and only warm the cache
+        with Metrics.stage('foursquare_search'):
+            done, not_done = wait(futures, timeout=budget)
+        for future in not_done:
+            future.cancel()
+
+        result_lists = []
+        failures = []
+        for future in futures:
+            if future not in done:
+                continue
+            try:
+                result_lists.append(future.result())
+            except FoursquareUnavailable as e:
+                failures.append(e)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # A malformed response (e.g. a 200 with a body that is not JSON) counts as a failed search
+                failures.append(FoursquareUnavailable(f"Invalid Foursquare response: {e}"))
+
+        # Only fail if no search got through and there is nothing stored nearby
+        if failures and not result_lists and not local_ids:
+            raise failures[0]
+
+        # Save new and stale places in one bulk transaction
+        with Metrics.stage('ingest'):
+            search_ids = PlaceIngestor.ingest(PlaceSearch.merge(result_lists))
+        return PlaceSearchResult(restaurant_ids=list(dict.fromkeys(local_ids + search_ids)),
+                                 local=len(local_ids),
+                                 searches=len(futures),
+                                 completed=len(result_lists),
+                                 failed=len(failures),
+                                 elapsed=time.monotonic() - start)
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from culinarycompass.models import UserProfile, PrecomputedRecommendation
+from culinarycompass.generate_recommendation import RecommendationGenerator
+from culinarycompass.restaurant_location import RestaurantLocation
+from culinarycompass.metrics import Metrics
+from culinarycompass import app, db
+
+# Ranked recommendations stored ahead of time so /find can answer without searching
+class PrecomputedRecommendations:
+
+    # Method for parsing "lat,lng" coordinates (None if they are invalid)
+    @staticmethod
+    def parse_coords(coords):
+        try:
+            lat, lng = (float(value) for value in coords.split(','))
+        except (AttributeError, ValueError):
+            return None
+        return lat, lng
+
+    # Method for checking if a stored list can be served (fresh, close enough and computed after the last profile change)
+    @staticmethod
+    def is_usable(stored, lat, lng, profile_updated=None):
+        max_age = timedelta(hours=app.config['RECOMMENDATION_PRECOMPUTE_MAX_AGE'])
+        if stored.date_computed < datetime.utcnow() - max_age:
+            return False
+        if profile_updated is not None and stored.date_computed < profile_updated:
+            return False
+        distance = RestaurantLocation.distance(lat, lng, stored.latitude, stored.longitude)
+        return distance <= app.config['RECOMMENDATION_PRECOMPUTE_TOLERANCE']
+
+    # Method for getting the stored ranking for the coordinates and radius (None if there is no usable one)
+    @staticmethod
+    def get(user_id, coords, radius):
+        position = PrecomputedRecommendations.parse_coords(coords)
+        if position is None:
+            return None
+        stored = PrecomputedRecommendation.query.filter_by(user_id=user_id, radius=radius).first()
+        if stored is None:
+            return None
+
+        profile_updated = db.session.query(UserProfile.date_updated).filter_by(user_id=user_id).scalar()
+        if not PrecomputedRecommendations.is_usable(stored, *position, profile_updated):
+            return None
+        stored.date_used = datetime.utcnow()
+        db.session.commit()
+        return stored.restaurant_ids
+
+    # Method for storing a ranking (replaces the user's list for the radius)
+    @staticmethod
+    def store(user_id, coords, radius, restaurant_ids, used=True):
+        position = PrecomputedRecommendations.parse_coords(coords)
+        if position is None:
+            return None
+        stored = PrecomputedRecommendation.query.filter_by(user_id=user_id, radius=radius).first()
+        if stored is None:
+            stored = PrecomputedRecommendation(user_id=user_id, radius=radius)
+            db.session.add(stored)
+        stored.latitude, stored.longitude = position
+        stored.restaurant_ids = list(restaurant_ids)
+        stored.date_computed = datetime.utcnow()
+        if used:
+            stored.date_used = stored.date_computed
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request stored the same user and radius first
+            db.session.rollback()
+            return None
+        return stored
+
+    # Method for getting the recommendations (stored if usable, otherwise computed live and stored)
+    @staticmethod
+    def recommend(user_id, coords, radius):
+        with Metrics.stage('precomputed_lookup'):
+            restaurant_ids = PrecomputedRecommendations.get(user_id, coords, radius)
+        if restaurant_ids is not None:
+            return restaurant_ids
+        local_search = RecommendationGenerator.recommend(user_id, coords, radius)
+        # Partial results (latency budget ran out) are served but not stored
+        if local_search.complete:
+            PrecomputedRecommendations.store(user_id, coords, radius, local_search.restaurant_ids)
+        return local_search.restaurant_ids
+
+    # Method for getting the users who asked for recommendations recently, with their most recent coordinates
+    @staticmethod
+    def active_users(days):
+        active_after = datetime.utcnow() - timedelta(days=days)
+        latest = {}
+        for stored in PrecomputedRecommendation.query \
+                .filter(PrecomputedRecommendation.date_used >= active_after) \
+                .order_by(PrecomputedRecommendation.date_used):
+            latest[stored.user_id] = f"{stored.latitude},{stored.longitude}"
+        return latest
+
+    # Method for precomputing the rankings of one user for several radii (returns the number stored)
+    @staticmethod
+    def precompute(user_id, coords, radii):
+        stored = 0
+        for radius in radii:
+            local_search = RecommendationGenerator.recommend(user_id, coords, radius)
+            if local_search.complete and PrecomputedRecommendations.store(user_id, coords, radius, local_search.restaurant_ids, used=False):
+                stored += 1
+        return stored
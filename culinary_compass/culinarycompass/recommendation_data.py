@@ -0,0 +1,47 @@
+from sqlalchemy.orm import contains_eager, selectinload
+
+from culinarycompass.models import Restaurant, RestaurantVisit, RestaurantFeature
+from culinarycompass import db
+
+# Visits rated at least this highly count towards the user's preferences
+MIN_RATING = 3
+
+# Data access layer for the recommender (loads everything in a constant number of queries)
+class RecommendationData:
+
+    # Method for picking the feature row of a restaurant (first row, matching the old .first() lookups)
+    @staticmethod
+    def first_features(restaurant):
+        if restaurant.features:
+            return min(restaurant.features, key=lambda feature: feature.id)
+        return None
+
+    # Method for loading the user's well rated visits joined with their restaurants and features
+    @staticmethod
+    def load_preferred_visits(user_id, min_rating=MIN_RATING):
+        # One query for the visits and restaurants, one IN query for all of their features
+        visits = RestaurantVisit.query \
+            .join(Restaurant, RestaurantVisit.restaurant_id == Restaurant.id) \
+            .options(contains_eager(RestaurantVisit.restaurant).selectinload(Restaurant.features)) \
+            .filter(RestaurantVisit.user_id == user_id) \
+            .filter(RestaurantVisit.rating >= min_rating) \
+            .all()
+
+        # Pair each visit's restaurant with its features so the scoring code never lazy loads
+        return [(visit.restaurant, RecommendationData.first_features(visit.restaurant)) for visit in visits]
+
+    # Method for loading restaurants and their features by id, keeping the order of the given ids
+    @staticmethod
+    def load_restaurants(restaurant_ids):
+        if not restaurant_ids:
+            return []
+
+        restaurants = Restaurant.query \
+            .options(selectinload(Restaurant.features)) \
+            .filter(Restaurant.id.in_(set(restaurant_ids))) \
+            .all()
+        restaurants_by_id = {restaurant.id: restaurant for restaurant in restaurants}
+
+        # Skip ids that are not in the local database
+        return [(restaurants_by_id[id], RecommendationData.first_features(restaurants_by_id[id]))
+                for id in restaurant_ids if id in restaurants_by_id]
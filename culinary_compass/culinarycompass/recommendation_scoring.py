@@ -0,0 +1,97 @@
+import numpy as np
+
+from culinarycompass.taste_profile import TasteProfile
+
+# Fixed order of the attributes in every feature vector
+FEATURE_NAMES = list(TasteProfile.empty_attributes().keys())
+
+# Scoring engine for ranking restaurants against a user's preferred attributes
+class RestaurantScorer:
+
+    # Method for setting the float value of a feature
+    @staticmethod
+    def get_feature_value(feature):
+        if feature is None:
+            return 0.0
+        elif isinstance(feature, bool):
+            return 1.0 if feature else 0.0
+        elif isinstance(feature, str):
+            # Return 0.3 if feature is Poor
+            if feature == 'Poor':
+                return 0.3
+            # Return 0.5 if feature is Average
+            elif feature == 'Average':
+                return 0.5
+            # Return 0.8 if feature is Great
+            elif feature == 'Great':
+                return 0.8
+        return 0.0
+
+    # Method for encoding a dictionary of feature values as float32 bytes (stored on the restaurant at ingest)
+    @staticmethod
+    def encode_values(feature_values):
+        values = [RestaurantScorer.get_feature_value(feature_values.get(feature_name)) for feature_name in FEATURE_NAMES]
+        return np.array(values, dtype=np.float32).tobytes()
+
+    # Method for encoding a restaurant's feature row
+    @staticmethod
+    def encode(features):
+        if features is None:
+            return RestaurantScorer.encode_values({})
+        return RestaurantScorer.encode_values({feature_name: getattr(features, feature_name, None) for feature_name in FEATURE_NAMES})
+
+    # Method for decoding a stored feature vector
+    @staticmethod
+    def decode(feature_vector):
+        return np.frombuffer(feature_vector, dtype=np.float32)
+
+    # Method for getting a restaurant's feature vector (encoding it if it predates stored vectors)
+    @staticmethod
+    def restaurant_vector(restaurant, features):
+        if restaurant.feature_vector is None:
+            restaurant.feature_vector = RestaurantScorer.encode(features)
+        return RestaurantScorer.decode(restaurant.feature_vector)
+
+    # Method for converting the preferred attributes dictionary to a vector
+    @staticmethod
+    def user_vector(preferred_attributes):
+        return np.array([preferred_attributes.get(feature_name, 0.0) for feature_name in FEATURE_NAMES], dtype=np.float32)
+
+    # Method for stacking restaurant vectors into a matrix
+    @staticmethod
+    def stack(vectors):
+        if not vectors:
+            return np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32)
+        return np.vstack(vectors)
+
+    # Method for computing the cosine similarity of every restaurant row with the user vector
+    @staticmethod
+    def cosine_scores(matrix, user_vector):
+        dots = matrix @ user_vector
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(user_vector)
+
+        # Restaurants (or users) without any features score 0
+        return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+    # Method for getting the row indices of the k best scores, best first (ties keep their original order)
+    @staticmethod
+    def top_k(scores, k=None):
+        if k is None or k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+
+        best = np.argpartition(-scores, k - 1)[:k]
+        return best[np.lexsort((best, -scores[best]))]
+
+    # Method for blending the content scores with collaborative filtering scores (weight 0 keeps the content ranking)
+    @staticmethod
+    def blend(content_scores, collaborative_scores, weight):
+        if collaborative_scores is None or weight <= 0:
+            return content_scores
+        return (1 - weight) * content_scores + weight * collaborative_scores
+
+    # Method for ranking candidate ids by cosine similarity with a single matrix-vector product
+    @staticmethod
+    def rank(candidate_ids, matrix, preferred_attributes, k=None, collaborative_scores=None, weight=0.0):
+        scores = RestaurantScorer.cosine_scores(matrix, RestaurantScorer.user_vector(preferred_attributes))
+        scores = RestaurantScorer.blend(scores, collaborative_scores, weight)
+        return [candidate_ids[i] for i in RestaurantScorer.top_k(scores, k)]
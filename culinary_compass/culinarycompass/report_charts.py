@@ -0,0 +1,59 @@
+import os
+from functools import lru_cache
+
+from culinarycompass import app
+
+# Chart template (shared by every report in the process)
+FIGURE_SIZE = (6.4, 4.8)
+FIGURE_DPI = 100
+BAR_COLOUR = (244/255, 140/255, 6/255)
+PIE_COLOURS = [(255/255, 186/255, 8/255), (244/255, 140/255, 6/255), (220/255, 47/255, 2/255)]
+
+# Thread-safe chart rendering on explicit figures (no global pyplot state)
+class ReportCharts:
+
+    # Method for loading the chart font once per process
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def font(size=10):
+        from matplotlib.font_manager import FontProperties
+        return FontProperties(fname=os.path.join(app.root_path, 'static/fonts/DMSans-Regular.ttf'), size=size)
+
+    # Method for creating a figure with its own Agg canvas and a single set of axes
+    @staticmethod
+    def new_figure():
+        # matplotlib is imported on the first chart, so web workers that never render a report do not load it
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        figure = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+        FigureCanvasAgg(figure)
+        return figure, figure.add_subplot()
+
+    # Method for handing a figure's rendered pixels to ReportLab (no PNG encode and decode round trip)
+    @staticmethod
+    def to_image(figure):
+        from PIL import Image
+        from reportlab.lib.utils import ImageReader
+        canvas = figure.canvas
+        canvas.draw()
+        image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return ImageReader(image.convert('RGB'))
+
+    # Method for rendering a bar graph of visits per category
+    @staticmethod
+    def bar_chart(categories, frequencies):
+        figure, axes = ReportCharts.new_figure()
+        axes.bar(categories, frequencies, color=BAR_COLOUR)
+        axes.set_ylabel('Number of Visits', fontproperties=ReportCharts.font())
+        axes.set_xticks(range(len(categories)), categories, rotation=0, ha='center', fontproperties=ReportCharts.font())
+        axes.set_yticks(range(max(frequencies) + 1))
+        figure.tight_layout()
+        return ReportCharts.to_image(figure)
+
+    # Method for rendering a pie chart of meal types
+    @staticmethod
+    def pie_chart(sizes, labels):
+        figure, axes = ReportCharts.new_figure()
+        axes.pie(sizes, labels=labels, startangle=140, colors=PIE_COLOURS, textprops={'fontproperties': ReportCharts.font()})
+        axes.axis('equal')
+        return ReportCharts.to_image(figure)
@@ -0,0 +1,160 @@
+import smtplib
+import threading
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+from sqlalchemy import update, or_, and_
+from sqlalchemy.exc import IntegrityError
+
+from culinarycompass.models import User, ReportJob
+from culinarycompass.generate_report import ReportGenerator
+from culinarycompass import app, db, mail
+
+# Statuses of jobs that are still in progress (a user can only have one of these)
+ACTIVE_STATUSES = ['queued', 'running']
+
+# Errors that are retried (mail server and connection failures)
+RETRY_ERRORS = (smtplib.SMTPException, OSError)
+
+# Function to build the report email (the PDF is attached straight from memory)
+def report_message(pdf_bytes, email, filename):
+    msg = Message('Your Culinary Mapped',
+                  sender='siddhdevelopment@gmail.com',
+                  recipients=[email])
+    msg.body = f'''Here is your Culinary Mapped:'''
+    msg.attach(filename, 'application/pdf', pdf_bytes)
+    return msg
+
+# Function to send the report email
+def send_report_email(pdf_bytes, email, filename):
+    mail.send(report_message(pdf_bytes, email, filename))
+
+# Persistent queue of report jobs stored in the database
+class ReportQueue:
+
+    # Method for getting the user's job that is still in progress
+    @staticmethod
+    def active_job(user_id):
+        return ReportJob.query.filter_by(user_id=user_id).filter(ReportJob.status.in_(ACTIVE_STATUSES)).first()
+
+    # Method for getting the user's most recent job
+    @staticmethod
+    def latest_job(user_id):
+        return ReportJob.query.filter_by(user_id=user_id).order_by(ReportJob.id.desc()).first()
+
+    # Method for queueing a report (returns the job and whether it is new, repeated clicks reuse the active job)
+    @staticmethod
+    def enqueue(user):
+        job = ReportQueue.active_job(user.id)
+        if job is not None:
+            return job, False
+
+        job = ReportJob(user_id=user.id)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request queued a job for the user at the same time
+            db.session.rollback()
+            return ReportQueue.active_job(user.id), False
+
+        ReportWorkerPool.start()
+        ReportWorkerPool.wake.set()
+        return job, True
+
+    # Method for claiming the next due job (also reclaims running jobs whose worker stopped responding)
+    @staticmethod
+    def claim():
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=app.config['REPORT_JOB_TIMEOUT'])
+        claimable = or_(and_(ReportJob.status == 'queued', ReportJob.run_after <= now),
+                        and_(ReportJob.status == 'running', ReportJob.date_updated < stale_before))
+
+        job_id = db.session.query(ReportJob.id).filter(claimable).order_by(ReportJob.run_after).limit(1).scalar()
+        if job_id is None:
+            return None
+
+        # Only one worker can move the job to running
+        result = db.session.execute(update(ReportJob)
+                                    .where(ReportJob.id == job_id)
+                                    .where(claimable)
+                                    .values(status='running', attempts=ReportJob.attempts + 1, date_updated=now))
+        db.session.commit()
+        if result.rowcount != 1:
+            return None
+        return db.session.get(ReportJob, job_id)
+
+    # Method for rendering and emailing a claimed job's report
+    @staticmethod
+    def run(job):
+        user = db.session.get(User, job.user_id)
+
+        try:
+            pdf_bytes = ReportGenerator.create_pdf(user.username)
+            send_report_email(pdf_bytes, user.email, f"{user.username}.pdf")
+            job.status = 'sent'
+            job.error = None
+        except RETRY_ERRORS as e:
+            db.session.rollback()
+            job.error = str(e)
+            # Retry with exponential backoff until the attempts run out
+            if job.attempts < app.config['REPORT_MAX_ATTEMPTS']:
+                job.status = 'queued'
+                job.run_after = datetime.utcnow() + timedelta(seconds=app.config['REPORT_RETRY_DELAY'] * 2 ** (job.attempts - 1))
+            else:
+                job.status = 'failed'
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)
+
+        job.date_updated = datetime.utcnow()
+        db.session.commit()
+        return job
+
+# Pool of background threads that process report jobs
+class ReportWorkerPool:
+    started = False
+    threads = []
+    lock = threading.Lock()
+    wake = threading.Event()
+
+    # Method for starting the worker threads of this process (once)
+    @staticmethod
+    def start(count=None):
+        if ReportWorkerPool.started:
+            return
+        count = app.config['REPORT_WORKERS'] if count is None else count
+        with ReportWorkerPool.lock:
+            if ReportWorkerPool.started:
+                return
+            ReportWorkerPool.started = True
+            for i in range(count):
+                thread = threading.Thread(target=ReportWorkerPool.work, name=f"report-worker-{i}", daemon=True)
+                thread.start()
+                ReportWorkerPool.threads.append(thread)
+
+    # Method for processing jobs until stopped (waits for new jobs when the queue is empty)
+    @staticmethod
+    def work(poll_interval=5, stop=None):
+        with app.app_context():
+            while stop is None or not stop.is_set():
+                try:
+                    job = ReportQueue.claim()
+                    if job is not None:
+                        ReportQueue.run(job)
+                        continue
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Report worker error")
+                finally:
+                    db.session.remove()
+
+                ReportWorkerPool.wake.wait(poll_interval)
+                ReportWorkerPool.wake.clear()
+
+# Function to start the report workers of each app process on its first request (after Gunicorn forks the workers, so
+# jobs that were queued, retrying or left running before a restart are picked up without waiting for a new job)
+@app.before_request
+def start_report_workers():
+    ReportWorkerPool.start()
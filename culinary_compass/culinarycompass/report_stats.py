@@ -0,0 +1,103 @@
+from datetime import datetime
+from dataclasses import dataclass, field
+from collections import Counter, defaultdict
+
+from sqlalchemy import func
+
+from culinarycompass.models import Restaurant, RestaurantVisit, RestaurantFeature
+from culinarycompass import db
+
+# Statistics shown in a user's year-end report
+@dataclass
+class ReportStats:
+    total_visits: int = 0
+    unique_restaurants: int = 0
+    favourite_restaurant: str = None
+    top_categories: list = field(default_factory=list) # (category name, visits) pairs, most visited first
+    breakfast_count: int = 0
+    lunch_count: int = 0
+    dinner_count: int = 0
+    price_categories: Counter = field(default_factory=Counter) # visits per price category (None if unknown)
+
+    # Method for getting the most common price category (None if there are no visits)
+    @property
+    def favourite_price(self):
+        if not self.price_categories:
+            return None
+        return self.price_categories.most_common(1)[0][0]
+
+# Aggregate queries for the report statistics
+class ReportStatsQuery:
+
+    # Method for getting the report category name of a restaurant (None if it has no specific category)
+    @staticmethod
+    def category_name(category):
+        all_categories = category.strip('[]').split(',')  # Remove brackets and split by comma
+        first_category_name = all_categories[0].split(':')[0].strip("'\"")  # Extract the name from the first category
+        if first_category_name.lower() == "restaurant":
+            return None
+        # If the category contains the word "restaurant", remove it
+        return first_category_name.replace("Restaurant", "").replace("restaurant", "").strip()
+
+    # Method for getting the date range of a year (a sargable filter instead of extracting the year)
+    @staticmethod
+    def year_range(year):
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+    # Method for computing the statistics of several users in one aggregate query
+    @staticmethod
+    def for_users(user_ids, year):
+        year_start, year_end = ReportStatsQuery.year_range(year)
+
+        # Visits and average rating per user and restaurant this year (restaurants have at most one feature row)
+        rows = db.session.query(RestaurantVisit.user_id,
+                                Restaurant.name,
+                                Restaurant.category,
+                                Restaurant.price,
+                                func.count(RestaurantVisit.id).label('visits'),
+                                func.avg(RestaurantVisit.rating).label('average_rating'),
+                                RestaurantFeature.breakfast,
+                                RestaurantFeature.lunch,
+                                RestaurantFeature.dinner) \
+            .join(Restaurant, RestaurantVisit.restaurant_id == Restaurant.id) \
+            .outerjoin(RestaurantFeature, RestaurantFeature.restaurant_id == Restaurant.id) \
+            .filter(RestaurantVisit.user_id.in_(user_ids)) \
+            .filter(RestaurantVisit.date_visited >= year_start) \
+            .filter(RestaurantVisit.date_visited < year_end) \
+            .group_by(RestaurantVisit.user_id, Restaurant.id, RestaurantFeature.id) \
+            .all()
+
+        # Combine the per restaurant rows (the work grows with unique restaurants, not visits)
+        rows_by_user = defaultdict(list)
+        for row in rows:
+            rows_by_user[row.user_id].append(row)
+
+        all_stats = {}
+        for user_id in user_ids:
+            stats = ReportStats()
+            user_rows = rows_by_user[user_id]
+            category_counts = Counter()
+            restaurant_names = set()
+            for row in user_rows:
+                stats.total_visits += row.visits
+                restaurant_names.add(row.name)
+                stats.breakfast_count += row.visits if row.breakfast else 0
+                stats.lunch_count += row.visits if row.lunch else 0
+                stats.dinner_count += row.visits if row.dinner else 0
+                stats.price_categories[row.price] += row.visits
+                category_name = ReportStatsQuery.category_name(row.category)
+                if category_name is not None:
+                    category_counts[category_name] += row.visits
+
+            # Favourite restaurant (most visits, highest average rating as a tiebreaker)
+            if user_rows:
+                stats.favourite_restaurant = max(user_rows, key=lambda row: (row.visits, row.average_rating)).name
+            stats.unique_restaurants = len(restaurant_names)
+            stats.top_categories = category_counts.most_common(5)
+            all_stats[user_id] = stats
+        return all_stats
+
+    # Method for computing the statistics of one user
+    @staticmethod
+    def for_user(user_id, year):
+        return ReportStatsQuery.for_users([user_id], year)[user_id]
@@ -0,0 +1,89 @@
+import os
+import threading
+from functools import lru_cache
+
+from culinarycompass import app
+
+# Name the report font is registered under
+FONT_NAME = "DM Sans"
+
+# US letter page size in points (the same as reportlab.lib.pagesizes.letter)
+PAGE_SIZE = (612.0, 792.0)
+
+# Report colours (RGB 0-255)
+HEADING_COLOUR = (232, 93, 4)
+TEXT_COLOUR = (68, 68, 68)
+
+# Name of the form XObject that holds the static headings of a report
+FURNITURE_FORM = 'ReportFurniture'
+
+# Text widths remembered per process (headings, numbers and restaurant names repeat across reports)
+TEXT_WIDTH_CACHE_SIZE = 4096
+
+# Per-process report template (the font is registered once, text widths are memoized and the static headings are
+# laid out once and drawn as a single form XObject)
+class ReportTemplate:
+    fonts_registered = False
+    lock = threading.Lock()
+
+    # Method for registering the report font (parses the TTF file once per process)
+    @staticmethod
+    def register_fonts():
+        if ReportTemplate.fonts_registered:
+            return
+        with ReportTemplate.lock:
+            if not ReportTemplate.fonts_registered:
+                from reportlab.pdfbase import pdfmetrics
+                from reportlab.pdfbase.ttfonts import TTFont
+                pdfmetrics.registerFont(TTFont(FONT_NAME, os.path.join(app.root_path, 'static/fonts/DMSans-Regular.ttf')))
+                ReportTemplate.fonts_registered = True
+
+    # Method for getting the width of a text in the report font
+    @staticmethod
+    @lru_cache(maxsize=TEXT_WIDTH_CACHE_SIZE)
+    def text_width(text, font_size):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        return stringWidth(text, FONT_NAME, font_size)
+
+    # Method for laying out a line of text (centred on x_val if it is given, otherwise on the page)
+    @staticmethod
+    @lru_cache(maxsize=TEXT_WIDTH_CACHE_SIZE)
+    def layout(text, font_size, font_colour, y_val=70, x_val=None):
+        page_width, page_height = PAGE_SIZE
+        text_width = ReportTemplate.text_width(text, font_size)
+        x = x_val - text_width / 2 if x_val else (page_width - text_width) / 2
+        colour = tuple(component / 255.0 for component in font_colour)
+        return x, page_height - y_val, colour
+
+    # Method for drawing a line of text
+    @staticmethod
+    def draw_text(canvas, text, font_size, font_colour, y_val=70, x_val=None):
+        x, y, colour = ReportTemplate.layout(text, font_size, font_colour, y_val, x_val)
+        canvas.setFont(FONT_NAME, font_size)
+        canvas.setFillColorRGB(*colour)
+        canvas.drawString(x, y, text)
+
+    # Method for getting the static headings of a report (the same for every user in a year)
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def furniture(year, found_user=True):
+        headings = [("Culinary Mapped", 48, HEADING_COLOUR, 70)]
+        if found_user:
+            headings += [(f"Here's a Recap of Your {year} in Food.", 32, HEADING_COLOUR, 120),
+                         ("Your Favourite Foods", 32, HEADING_COLOUR, 270),
+                         ("Your Culinary Habits", 32, HEADING_COLOUR, 560)]
+        else:
+            headings += [("There was an error generating your Culinary Mapped.", 24, TEXT_COLOUR, 70)]
+        # Resolve every position up front so drawing the form is only canvas operations
+        return tuple((text, font_size, ReportTemplate.layout(text, font_size, colour, y_val)) for text, font_size, colour, y_val in headings)
+
+    # Method for drawing the static headings as a form XObject
+    @staticmethod
+    def draw_furniture(canvas, year, found_user=True):
+        canvas.beginForm(FURNITURE_FORM)
+        for text, font_size, (x, y, colour) in ReportTemplate.furniture(year, found_user):
+            canvas.setFont(FONT_NAME, font_size)
+            canvas.setFillColorRGB(*colour)
+            canvas.drawString(x, y, text)
+        canvas.endForm()
+        canvas.doForm(FURNITURE_FORM)
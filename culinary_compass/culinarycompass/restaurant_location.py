@@ -0,0 +1,133 @@
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy.sql import table, column
+
+from culinarycompass.models import Restaurant
+from culinarycompass.restaurant_search import RestaurantSearch
+from culinarycompass import app, db
+
+# SQLite R*Tree index of the restaurant coordinates (its id is the restaurant's index_key)
+location_table = table('restaurant_location', column('id'), column('min_lat'), column('max_lat'), column('min_lng'), column('max_lng'))
+
+# Triggers that keep the index in sync with the restaurant table
+TRIGGERS = ['restaurant_location_insert', 'restaurant_location_update', 'restaurant_location_delete']
+
+# Statements that create the index and its triggers (new rows are indexed when the key trigger sets their index_key)
+CREATE_INDEX_STATEMENTS = [
+    "CREATE VIRTUAL TABLE restaurant_location USING rtree(id, min_lat, max_lat, min_lng, max_lng)",
+    """CREATE TRIGGER restaurant_location_insert AFTER INSERT ON restaurant
+        WHEN new.index_key IS NOT NULL AND new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO restaurant_location (id, min_lat, max_lat, min_lng, max_lng)
+        VALUES (new.index_key, new.latitude, new.latitude, new.longitude, new.longitude);
+    END""",
+    """CREATE TRIGGER restaurant_location_update AFTER UPDATE OF index_key, latitude, longitude ON restaurant BEGIN
+        DELETE FROM restaurant_location WHERE id = old.index_key;
+        INSERT INTO restaurant_location (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT new.index_key, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.index_key IS NOT NULL AND new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END""",
+    """CREATE TRIGGER restaurant_location_delete AFTER DELETE ON restaurant BEGIN
+        DELETE FROM restaurant_location WHERE id = old.index_key;
+    END""",
+    """INSERT INTO restaurant_location (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT index_key, latitude, latitude, longitude, longitude FROM restaurant
+        WHERE index_key IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL""",
+]
+
+# Query counting index rows without a located restaurant and located restaurants missing from the index
+DRIFT_QUERY = """SELECT (SELECT COUNT(*) FROM restaurant_location
+                         WHERE id NOT IN (SELECT index_key FROM restaurant
+                                          WHERE index_key IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL))
+                      + (SELECT COUNT(*) FROM restaurant WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                         AND (index_key IS NULL OR index_key NOT IN (SELECT id FROM restaurant_location)))"""
+
+# Mean radius of the Earth in kilometres
+EARTH_RADIUS_KM = 6371.0
+
+# Geospatial lookups of the restaurants already stored locally
+class RestaurantLocation:
+
+    # Method for checking if the database supports the R*Tree index (other databases use the latitude/longitude index)
+    @staticmethod
+    def available(connection=None):
+        dialect = connection.dialect if connection is not None else db.engine.dialect
+        return dialect.name == 'sqlite'
+
+    # Method for creating and filling the index if it does not exist (returns True if it was created)
+    @staticmethod
+    def create_index(connection):
+        if not RestaurantLocation.available(connection):
+            return False
+        return RestaurantSearch.create_virtual_index(connection, 'restaurant_location', TRIGGERS, CREATE_INDEX_STATEMENTS)
+
+    # Method for rebuilding the index from the restaurant table
+    @staticmethod
+    def rebuild(connection):
+        RestaurantSearch.create_index_key(connection)
+        connection.exec_driver_sql("DELETE FROM restaurant_location")
+        connection.exec_driver_sql(CREATE_INDEX_STATEMENTS[-1])
+
+    # Method for counting the rows where the index and the restaurant table disagree (0 when they are in sync)
+    @staticmethod
+    def drift(connection):
+        return connection.exec_driver_sql(DRIFT_QUERY).scalar()
+
+    # Method for getting the coordinates of a place payload (None if it has no geocodes)
+    @staticmethod
+    def place_coordinates(place_data):
+        main = (place_data.get('geocodes') or {}).get('main') or {}
+        if main.get('latitude') is None or main.get('longitude') is None:
+            return None, None
+        return main['latitude'], main['longitude']
+
+    # Method for getting the great-circle distance between two points in kilometres
+    @staticmethod
+    def distance(lat1, lng1, lat2, lng2):
+        lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+    # Method for getting the latitude/longitude box around a circle (radius in km)
+    @staticmethod
+    def bounding_box(lat, lng, radius):
+        lat_delta = math.degrees(radius / EARTH_RADIUS_KM)
+        lng_delta = math.degrees(radius / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 0.01)))
+        return lat - lat_delta, lat + lat_delta, lng - lng_delta, lng + lng_delta
+
+    # Method for building the box lookup on the spatial index (only places that would not be refreshed from Foursquare)
+    @staticmethod
+    def box_query(lat, lng, radius):
+        min_lat, max_lat, min_lng, max_lng = RestaurantLocation.bounding_box(lat, lng, radius)
+        refresh_before = datetime.utcnow() - timedelta(days=app.config['PLACE_REFRESH_DAYS'])
+        query = db.session.query(Restaurant.id, Restaurant.latitude, Restaurant.longitude, Restaurant.category) \
+            .filter(Restaurant.date_updated >= refresh_before)
+        if RestaurantLocation.available():
+            query = query \
+                .join(location_table, location_table.c.id == Restaurant.index_key) \
+                .filter(location_table.c.min_lat >= min_lat, location_table.c.max_lat <= max_lat,
+                        location_table.c.min_lng >= min_lng, location_table.c.max_lng <= max_lng)
+        else:
+            query = query.filter(Restaurant.latitude.between(min_lat, max_lat), Restaurant.longitude.between(min_lng, max_lng))
+        return query
+
+    # Method for finding fresh stored restaurants within the radius, grouped by the requested category ids
+    @staticmethod
+    def nearby(coords, radius, category_ids):
+        try:
+            lat, lng = (float(value) for value in coords.split(','))
+        except (AttributeError, ValueError):
+            return {category_id: [] for category_id in category_ids}
+
+        # Exact distance and category filters on the rows in the box (closest first)
+        nearby = {category_id: [] for category_id in category_ids}
+        rows = [(RestaurantLocation.distance(lat, lng, row.latitude, row.longitude), row)
+                for row in RestaurantLocation.box_query(lat, lng, radius).all()]
+        for distance, row in sorted(rows, key=lambda item: (item[0], item[1].id)):
+            if distance > radius:
+                continue
+            restaurant_category_ids = {category.rsplit(':', 1)[-1] for category in row.category.split(',')}
+            for category_id in category_ids:
+                if category_id in restaurant_category_ids:
+                    nearby[category_id].append(row.id)
+        return nearby
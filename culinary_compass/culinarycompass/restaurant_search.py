@@ -0,0 +1,132 @@
+import re
+
+from sqlalchemy import or_, and_, false, literal_column
+from sqlalchemy.sql import table, column
+
+from culinarycompass.models import Restaurant, RestaurantVisit
+from culinarycompass import db
+
+# SQLite FTS5 index of the restaurant text (its rowid is the restaurant's index_key)
+search_table = table('restaurant_search', column('rowid'), column('rank'))
+
+# Statements that give every restaurant a stable index key (existing rows first, then new rows on insert)
+INDEX_KEY_STATEMENTS = [
+    """UPDATE restaurant SET index_key = rowid + (SELECT IFNULL(MAX(index_key), 0) FROM restaurant)
+        WHERE index_key IS NULL""",
+    """CREATE TRIGGER IF NOT EXISTS restaurant_index_key AFTER INSERT ON restaurant WHEN new.index_key IS NULL BEGIN
+        UPDATE restaurant SET index_key = (SELECT IFNULL(MAX(index_key), 0) + 1 FROM restaurant) WHERE rowid = new.rowid;
+    END""",
+]
+
+# Triggers that keep the index in sync with the restaurant table
+TRIGGERS = ['restaurant_search_insert', 'restaurant_search_update', 'restaurant_search_delete']
+
+# Statements that create the index and its triggers (new rows are indexed when the key trigger sets their index_key)
+CREATE_INDEX_STATEMENTS = [
+    "CREATE VIRTUAL TABLE restaurant_search USING fts5(name, address, category, tastes, tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER restaurant_search_insert AFTER INSERT ON restaurant WHEN new.index_key IS NOT NULL BEGIN
+        INSERT INTO restaurant_search (rowid, name, address, category, tastes)
+        VALUES (new.index_key, new.name, new.address, new.category, new.tastes);
+    END""",
+    """CREATE TRIGGER restaurant_search_update AFTER UPDATE OF index_key, name, address, category, tastes ON restaurant BEGIN
+        DELETE FROM restaurant_search WHERE rowid = old.index_key;
+        INSERT INTO restaurant_search (rowid, name, address, category, tastes)
+        SELECT new.index_key, new.name, new.address, new.category, new.tastes WHERE new.index_key IS NOT NULL;
+    END""",
+    """CREATE TRIGGER restaurant_search_delete AFTER DELETE ON restaurant BEGIN
+        DELETE FROM restaurant_search WHERE rowid = old.index_key;
+    END""",
+    """INSERT INTO restaurant_search (rowid, name, address, category, tastes)
+        SELECT index_key, name, address, category, tastes FROM restaurant WHERE index_key IS NOT NULL""",
+]
+
+# Query counting index rows without a restaurant and restaurants missing from the index
+DRIFT_QUERY = """SELECT (SELECT COUNT(*) FROM restaurant_search
+                         WHERE rowid NOT IN (SELECT index_key FROM restaurant WHERE index_key IS NOT NULL))
+                      + (SELECT COUNT(*) FROM restaurant
+                         WHERE index_key IS NULL OR index_key NOT IN (SELECT rowid FROM restaurant_search))"""
+
+# Full-text search over restaurant names, addresses, categories and tastes
+class RestaurantSearch:
+
+    # Method for checking if the database supports the FTS5 index (other databases use the fallback)
+    @staticmethod
+    def available(connection=None):
+        dialect = connection.dialect if connection is not None else db.engine.dialect
+        return dialect.name == 'sqlite'
+
+    # Method for giving every restaurant an index key and creating the trigger that keys new restaurants
+    @staticmethod
+    def create_index_key(connection):
+        for statement in INDEX_KEY_STATEMENTS:
+            connection.exec_driver_sql(statement)
+
+    # Method for checking if an index's trigger is missing or still uses the restaurant rowid (created before index_key)
+    @staticmethod
+    def trigger_outdated(connection, trigger):
+        trigger_sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (trigger,)).scalar()
+        return trigger_sql is None or 'index_key' not in trigger_sql
+
+    # Method for creating and filling an index if it does not exist or is outdated (returns True if it was created)
+    @staticmethod
+    def create_virtual_index(connection, name, triggers, statements):
+        RestaurantSearch.create_index_key(connection)
+        exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).first()
+        if exists and not RestaurantSearch.trigger_outdated(connection, triggers[0]):
+            return False
+        for trigger in triggers:
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+        return True
+
+    # Method for creating and filling the index if it does not exist (returns True if it was created)
+    @staticmethod
+    def create_index(connection):
+        if not RestaurantSearch.available(connection):
+            return False
+        return RestaurantSearch.create_virtual_index(connection, 'restaurant_search', TRIGGERS, CREATE_INDEX_STATEMENTS)
+
+    # Method for rebuilding the index from the restaurant table
+    @staticmethod
+    def rebuild(connection):
+        RestaurantSearch.create_index_key(connection)
+        connection.exec_driver_sql("DELETE FROM restaurant_search")
+        connection.exec_driver_sql(CREATE_INDEX_STATEMENTS[-1])
+
+    # Method for counting the rows where the index and the restaurant table disagree (0 when they are in sync)
+    @staticmethod
+    def drift(connection):
+        return connection.exec_driver_sql(DRIFT_QUERY).scalar()
+
+    # Method for splitting the search query into words
+    @staticmethod
+    def words(search_query):
+        return re.findall(r"\w+", search_query)
+
+    # Method for building an FTS5 query that prefix matches every word
+    @staticmethod
+    def match_query(search_query):
+        return ' '.join(f'"{word}"*' for word in RestaurantSearch.words(search_query))
+
+    # Method for filtering a visit query by the search query (returns the query and its ordering)
+    @staticmethod
+    def filter_visits(query, search_query):
+        if not RestaurantSearch.words(search_query):
+            return query.filter(false()), []
+
+        query = query.join(Restaurant, RestaurantVisit.restaurant_id == Restaurant.id)
+        if RestaurantSearch.available():
+            # Matches come from the FTS index and are joined to the visits by restaurant, best matches first
+            query = query \
+                .join(search_table, search_table.c.rowid == Restaurant.index_key) \
+                .filter(literal_column('restaurant_search').op('MATCH')(RestaurantSearch.match_query(search_query)))
+            return query, [search_table.c.rank]
+
+        # Fallback for other databases: every word must prefix match a word in one of the columns
+        word_filters = []
+        for word in RestaurantSearch.words(search_query):
+            word_filters.append(or_(*[column_name.ilike(f"{word}%") | column_name.ilike(f"% {word}%")
+                                      for column_name in (Restaurant.name, Restaurant.address, Restaurant.category, Restaurant.tastes)]))
+        return query.filter(and_(*word_filters)), []
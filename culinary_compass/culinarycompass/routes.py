@@ -1,14 +1,13 @@
 import os
 import secrets
-import requests
+from io import BytesIO
 from PIL import Image
-from flask import jsonify, render_template, url_for, flash, redirect, request, session
+from flask import jsonify, render_template, url_for, flash, redirect, request, session, send_file, abort
 from flask_login import login_user, current_user, logout_user, login_required
 from flask_mail import Message
-from sqlalchemy import or_
 
 # Import modules, forms, models
-from culinarycompass import app, db, bcrypt, mail, google, foursquare
+from culinarycompass import app, db, bcrypt, mail, google
 from culinarycompass.forms import (RegistrationForm,
                                    LoginForm,
                                    UpdateAccountForm,
@@ -24,6 +23,17 @@ from culinarycompass.models import User, Restaurant, RestaurantVisit, Restaurant
 # Custom classes
 from .generate_report import ReportGenerator
 from .generate_recommendation import RecommendationGenerator
+from .recommendation_data import RecommendationData
+from .taste_profile import TasteProfile
+from .foursquare_client import foursquare_client, FoursquareUnavailable
+from .place_ingest import PlaceIngestor
+from .report_jobs import ReportQueue
+from .visit_history import VisitHistory
+from .user_cache import UserCache
+from .precomputed_recommendations import PrecomputedRecommendations
+from .item_neighbours import ItemNeighbours
+from .metrics import Metrics
+from .database import DatabaseRouting
 
 # Home page
 @app.route("/")
@@ -98,25 +108,6 @@ def save_picture(form_picture):
     
     return(picture_name)
 
-# Function to send the report email
-def send_report_email(pdf_path):
-    msg = Message('Your Culinary Mapped',
-                  sender='siddhdevelopment@gmail.com',
-                  recipients=[current_user.email])
-    msg.body = f'''Here is your Culinary Mapped:'''
-    
-    filename = os.path.basename(pdf_path)
-    with app.open_resource(pdf_path) as attachment:
-        msg.attach(filename, 'application/pdf', attachment.read())
-    mail.send(msg)
-
-# Function to delete the report
-def delete_report(pdf_path):
-    try:
-        os.remove(pdf_path)
-    except OSError as e:
-        print(f"Error deleting file: {pdf_path} - {e}")
-
 @app.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
@@ -132,6 +123,7 @@ def account():
             current_user.image_file = picture_file
 
         db.session.commit()
+        UserCache.changed(current_user.id)
         flash('Your account has been updated!', 'success')
         return(redirect(url_for('account')))
     elif request.method == 'GET':
@@ -146,7 +138,9 @@ def account():
         current_user.gluten = questionnaire_form.gluten.data
         current_user.healthy = questionnaire_form.healthy.data
         current_user.no_alcohol = questionnaire_form.no_alcohol.data
+        TasteProfile.update_questionnaire(current_user)
         db.session.commit()
+        UserCache.changed(current_user.id)
         flash('Your account has been updated!', 'success')
         return(redirect(url_for('account')))
     elif request.method == 'GET':
@@ -158,19 +152,40 @@ def account():
     # Report form
     report_form = ReportForm()
     if report_form.validate_on_submit():
-        pdf_name = current_user.username
-        pdf_path = os.path.join(app.root_path, 'static/reports', pdf_name + ".pdf")
-        ReportGenerator.create_pdf(pdf_path, current_user.username)
-        send_report_email(pdf_path)
-        delete_report(pdf_path)
-        flash('A report has been sent to your email', 'success')
+        # Queue the report so it is rendered and emailed in the background
+        job, created = ReportQueue.enqueue(current_user)
+        if created:
+            flash('Your report is being generated and will be sent to your email shortly.', 'success')
+        else:
+            flash('Your report is already being generated.', 'info')
         return(redirect(url_for('account')))
+    report_job = ReportQueue.latest_job(current_user.id)
     return(render_template('account.html',
                            title='Account',
                            image_file=image_file,
                            update_account_form=update_account_form,
                            questionnaire_form=questionnaire_form,
-                           report_form=report_form))
+                           report_form=report_form,
+                           report_job=report_job))
+
+# Report download (renders the report in memory and streams it)
+@app.route("/report")
+@login_required
+def download_report():
+    pdf_bytes = ReportGenerator.create_pdf(current_user.username)
+    return(send_file(BytesIO(pdf_bytes),
+                     mimetype='application/pdf',
+                     as_attachment=True,
+                     download_name=f"{current_user.username}.pdf"))
+
+# Report status (polled by the account page)
+@app.route("/report_status")
+@login_required
+def report_status():
+    job = ReportQueue.latest_job(current_user.id)
+    if job is None:
+        return jsonify({'status': None})
+    return jsonify({'status': job.status, 'attempts': job.attempts, 'updated': job.date_updated.isoformat()})
 
 # Reset password pages
 
@@ -221,6 +236,7 @@ def reset_token(token):
         hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
         user.password = hashed_password
         db.session.commit()
+        UserCache.changed(user.id)
         flash('Your password has been updated. You are now able to log in.', 'success')
         return(redirect(url_for('login')))
     return(render_template('reset_token.html', title='Reset Password', form=form))
@@ -245,12 +261,11 @@ def add():
         restaurant_name = parts[0] # Get the name of the restaurant
         
         # FourSquare API request
-        url = f"https://api.foursquare.com/v3/places/match?name={restaurant_name}&ll={restaurant_coords}&fields=fsq_id%2Ccategories%2Cmenu%2Cwebsite%2Cprice%2Ctastes%2Cfeatures%2Clocation%2Cdescription"
-        headers = {
-            "accept": "application/json",
-            "Authorization": foursquare
-        }
-        response = requests.get(url, headers=headers)
+        try:
+            response = foursquare_client.match_place(restaurant_name, restaurant_coords, "name,fsq_id,categories,menu,website,price,tastes,features,location,geocodes,description")
+        except FoursquareUnavailable:
+            flash('Restaurant search is unavailable right now. Please try again later.', 'danger')
+            return(redirect(url_for('add')))
         parsed_data = response.json()
 
         # If a match is found
@@ -259,77 +274,10 @@ def add():
             # Extract and store restaurant id in session
             fsq_id = parsed_data['place']['fsq_id']
             session['fsq_id'] = fsq_id  
-            
-            # Extract the category information and store as a string
-            categories = [f"{category['short_name']}:{category['id']}" for category in parsed_data['place']['categories']]
-            categories_str = ",".join(categories) 
-            
-            # Extract the tastes information and store as a string
-            tastes = parsed_data['place'].get('tastes')
-            tastes_str = ",".join(tastes) if tastes else None
-            
-            # Extract other information
-            menu = parsed_data['place'].get('menu')
-            website = parsed_data['place'].get('website')
-            description = parsed_data['place'].get('description')
-            price = parsed_data['place'].get('price')
-            address = parsed_data['place']['location']['formatted_address']
-
-            # Check if restaurant features information is available
-            if 'features' in parsed_data['place']:
-                features_data = parsed_data['place']['features']
-            else:
-                features_data = None
-
-            # Create a list of feature names based on the RestaurantFeature model columns
-            feature_columns = [column.name for column in RestaurantFeature.__table__.columns]
-            feature_values = {}
-            ignore_sections = ['payment', 'services', 'amenities']
-
-            # Function to flatten nested JSON structures
-            def flatten_features(data, prefix=""):
-                if data is None:
-                    return {}
-
-                flat_data = {}
-                for key, value in data.items():
-                    if key in ignore_sections:
-                        continue
-                    if isinstance(value, dict):
-                        flat_data.update(flatten_features(value, f"{prefix}{key}_"))
-                    else:
-                        flat_data[key] = value
-                return flat_data
-            flattened_features = flatten_features(features_data)
-
-            # Add feature values to dictionary
-            for feature_name, feature_data in flattened_features.items():
-                if feature_name in feature_columns:
-                    feature_values[feature_name] = feature_data
-
-            # Query the local database for the restaurant
-            restaurant_exists = Restaurant.query.filter_by(id=fsq_id).first()
-            
-            # Add restaurant information to local database if not already there
-            if not restaurant_exists:
-                restaurant = Restaurant(
-                    id=fsq_id,
-                    full_name=restaurant_full_name,
-                    name=restaurant_name, 
-                    address=address, 
-                    category=categories_str, 
-                    website=website, 
-                    menu=menu, 
-                    price=price, 
-                    description=description, 
-                    tastes=tastes_str
-                )
-                if feature_values:
-                    restaurant_features = RestaurantFeature(restaurant_id=restaurant.id, **feature_values)
-                    db.session.add(restaurant_features)
-                db.session.add(restaurant)
-                db.session.commit()
-            found = True
+
+            # Add (or refresh) the restaurant information in the local database (found only if it was stored)
+            stored_ids = PlaceIngestor.ingest([parsed_data['place']], names={fsq_id: (restaurant_full_name, restaurant_name)})
+            found = fsq_id in stored_ids
         # If a match is not found in the FourSquare database
         else:
             found = False
@@ -348,7 +296,10 @@ def add():
         rating = submit_form.rating.data
         restaurant_visit = RestaurantVisit(user_id = current_user.id, restaurant_id = session['fsq_id'], date_visited = date, rating=rating)
         db.session.add(restaurant_visit)
+        TasteProfile.add_visit(current_user, restaurant_visit)
         db.session.commit()
+        VisitHistory.invalidate(current_user.id)
+        ItemNeighbours.schedule_update(restaurant_visit.restaurant_id)
         flash('Added restaurant to my restaurants', 'success')
         return(redirect(url_for('my')))
     return render_template('add_restaurant.html', title='Add Restaurant', search_form=search_form, key=google, api=True)
@@ -358,18 +309,15 @@ def add():
 @login_required
 def my():
     page = request.args.get('page', default=1, type=int)
+    cursor = request.args.get('cursor')
     search_query = request.args.get('q', '').strip()
     
-    # Database query to filter by user and search query
-    base_query = RestaurantVisit.query.filter_by(user_id=current_user.id)
-    if search_query:
-        search_filter = or_(
-            RestaurantVisit.restaurant.has(Restaurant.name.ilike(f"%{search_query}%")),
-            RestaurantVisit.restaurant.has(Restaurant.address.ilike(f"%{search_query}%"))
-        )
-        restaurant_visits = base_query.filter(search_filter).order_by(RestaurantVisit.date_visited.desc()).paginate(page=page, per_page=10)
-    else:
-        restaurant_visits = base_query.order_by(RestaurantVisit.date_visited.desc()).paginate(page=page, per_page=10)
+    # Search results are ranked pages, the full history is paged by cursor (newest first), both read from the replica if there is one
+    with DatabaseRouting.replica():
+        if search_query:
+            restaurant_visits = VisitHistory.search_page(current_user.id, search_query, page=page)
+        else:
+            restaurant_visits = VisitHistory.page(current_user.id, cursor=cursor)
     return(render_template('my_restaurants.html', title='My Restaurants', restaurant_visits=restaurant_visits, search_query=search_query))
 
 # Find restaurants page
@@ -384,8 +332,7 @@ def update_coordinates():
 @app.route("/find", methods=['GET', 'POST'])
 @login_required
 def find():
-    has_visited = RestaurantVisit.query.filter_by(user_id=current_user.id).first() is not None
-    if not has_visited:
+    if not VisitHistory.has_visits(current_user.id):
         flash('Please add restaurants to your history before generating recommendations.', 'danger')
         return(redirect(url_for('my')))
     
@@ -394,8 +341,60 @@ def find():
     coords = session.get('coordinates', None)
     if form.validate_on_submit():
         radius = form.radius.data
-        recommended_ids = RecommendationGenerator.generate_recommendation(current_user.id, coords, radius)
-        recommendations = [Restaurant.query.get(id) for id in recommended_ids]
+        try:
+            # Served from the precomputed table when a fresh list exists for this location and radius
+            recommended_ids = PrecomputedRecommendations.recommend(current_user.id, coords, radius)
+        except FoursquareUnavailable:
+            flash('Recommendations are unavailable right now. Please try again later.', 'danger')
+            return(redirect(url_for('find')))
+        recommendations = [restaurant for restaurant, features in RecommendationData.load_restaurants(recommended_ids)]
         return(render_template('find_restaurants.html', title='Find Restaurants', key=google, form=form, api=True, recommendations=recommendations))
     # Render the find restaurants template without recommendations if the form has not been submitted
-    return(render_template('find_restaurants.html', title='Find Restaurants', key=google, form=form, api=True))
\ No newline at end of file
+    return(render_template('find_restaurants.html', title='Find Restaurants', key=google, form=form, api=True))
+
+# Recommendations API (JSON, same search and ranking as /find)
+@app.route("/api/recommendations")
+@login_required
+def api_recommendations():
+    if not VisitHistory.has_visits(current_user.id):
+        return jsonify({'error': 'Add restaurants to your history before generating recommendations.'}), 400
+
+    # Coordinates default to the last location sent from the find page
+    coords = request.args.get('coords', session.get('coordinates'))
+    radius = request.args.get('radius', default=5, type=int)
+    limit = request.args.get('limit', type=int)
+    if not coords:
+        return jsonify({'error': 'Coordinates are required.'}), 400
+    if radius is None or not 1 <= radius <= 30:
+        return jsonify({'error': 'Radius must be between 1 and 30 km.'}), 400
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'Limit must be at least 1.'}), 400
+
+    try:
+        local_search = RecommendationGenerator.recommend(current_user.id, coords, radius, k=limit)
+    except FoursquareUnavailable:
+        return jsonify({'error': 'Recommendations are unavailable right now. Please try again later.'}), 503
+
+    restaurants = [{'id': restaurant.id,
+                    'name': restaurant.name,
+                    'address': restaurant.address,
+                    'category': restaurant.category,
+                    'price': restaurant.price,
+                    'website': restaurant.website}
+                   for restaurant, features in RecommendationData.load_restaurants(local_search.restaurant_ids)]
+    return jsonify({'restaurants': restaurants,
+                    'complete': local_search.complete,
+                    'local_restaurants': local_search.local,
+                    'searches': local_search.searches,
+                    'completed_searches': local_search.completed,
+                    'failed_searches': local_search.failed,
+                    'elapsed_ms': round(local_search.elapsed * 1000)})
+
+# Prometheus metrics (only served when instrumentation is enabled, to the metrics token or allowed addresses)
+@app.route("/metrics")
+def metrics():
+    if not Metrics.enabled():
+        abort(404)
+    if not Metrics.authorized():
+        abort(403)
+    return Metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
\ No newline at end of file
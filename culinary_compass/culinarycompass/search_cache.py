@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from culinarycompass import app
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Function to encode coordinates as a geohash (nearby coordinates share a prefix)
+def geohash(lat, lng, precision):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash_chars = []
+    bits = 0
+    bit_count = 0
+    even_bit = True
+
+    while len(geohash_chars) < precision:
+        # Alternate between halving the longitude and latitude ranges
+        value_range, value = (lng_range, lng) if even_bit else (lat_range, lat)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits = bits << 1
+            value_range[1] = middle
+        even_bit = not even_bit
+
+        bit_count += 1
+        if bit_count == 5:
+            geohash_chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash_chars)
+
+# In-process cache backend (LRU with expiry, one per worker)
+class MemoryCacheBackend:
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Method for getting an unexpired value (moves it to the most recently used end)
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # Method for storing a value (evicts the least recently used entries when full)
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'backend': 'memory', 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+# Seconds between refreshes of an entry's last used time (reads in between do not write)
+LAST_USED_RESOLUTION = 60
+
+# Hit and miss counts kept in memory before they are added to the shared counters (also flushed after STATS_FLUSH_SECONDS)
+STATS_FLUSH_COUNT = 100
+STATS_FLUSH_SECONDS = 30
+
+# On-disk SQLite cache backend (shared by workers and kept across restarts)
+class SQLiteCacheBackend:
+
+    def __init__(self, path, max_entries, journal_mode='WAL', busy_timeout=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.journal_mode = journal_mode
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = False
+        self.hits = 0
+        self.misses = 0
+        self.last_flush = time.monotonic()
+
+    # Method for creating the cache file and tables (on first use rather than at import)
+    def create(self, connection):
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS search_cache '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_search_cache_last_used ON search_cache (last_used)')
+            connection.execute('CREATE TABLE IF NOT EXISTS search_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            connection.execute("INSERT OR IGNORE INTO search_cache_stats VALUES ('hits', 0), ('misses', 0)")
+
+    # Method for getting this thread's connection (opened once per thread and process, with WAL so reads do not block)
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000)
+            connection.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+            with self.lock:
+                if not self.created:
+                    self.create(connection)
+                    self.created = True
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    # Method for running statements in a transaction that commits when the block ends
+    @contextmanager
+    def connect(self):
+        connection = self.connection()
+        with connection:
+            yield connection
+
+    # Method for counting a hit or a miss (added to the shared counters in batches)
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            due = self.hits + self.misses >= STATS_FLUSH_COUNT or time.monotonic() - self.last_flush >= STATS_FLUSH_SECONDS
+        if due:
+            self.flush_stats()
+
+    # Method for adding this process's hit and miss counts to the shared counters
+    def flush_stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+            self.last_flush = time.monotonic()
+        if hits or misses:
+            with self.connect() as connection:
+                connection.execute("UPDATE search_cache_stats SET value = value + ? WHERE name = 'hits'", (hits,))
+                connection.execute("UPDATE search_cache_stats SET value = value + ? WHERE name = 'misses'", (misses,))
+
+    # Method for getting an unexpired value (a read only lookup, its last used time is refreshed at most once a minute)
+    def get(self, key):
+        now = time.time()
+        row = self.connection().execute('SELECT value, last_used FROM search_cache WHERE key = ? AND expires_at >= ?',
+                                        (key, now)).fetchone()
+        self.count(row is not None)
+        if row is None:
+            return None
+        if now - row[1] >= LAST_USED_RESOLUTION:
+            with self.connect() as connection:
+                connection.execute('UPDATE search_cache SET last_used = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    # Method for storing a value (drops expired rows, then the least recently used rows when full)
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?)', (key, json.dumps(value), now + ttl, now))
+            connection.execute('DELETE FROM search_cache WHERE expires_at < ?', (now,))
+            connection.execute('DELETE FROM search_cache WHERE key IN '
+                               '(SELECT key FROM search_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        with self.connect() as connection:
+            connection.execute('DELETE FROM search_cache')
+
+    def stats(self):
+        self.flush_stats()
+        with self.connect() as connection:
+            entries = connection.execute('SELECT COUNT(*) FROM search_cache').fetchone()[0]
+            counters = dict(connection.execute('SELECT name, value FROM search_cache_stats').fetchall())
+        return {'backend': 'sqlite', 'entries': entries, 'hits': counters['hits'], 'misses': counters['misses']}
+
+# Cache for Foursquare place search responses, keyed by geo-cell, categories and radius
+class SearchCache:
+
+    def __init__(self, backend, ttl, precision):
+        self.backend = backend
+        self.ttl = ttl
+        self.precision = precision
+
+    # Method for creating the cache from the app config
+    @staticmethod
+    def from_config(config):
+        max_entries = config['FOURSQUARE_CACHE_MAX_ENTRIES']
+        if config['FOURSQUARE_CACHE_BACKEND'] == 'sqlite':
+            backend = SQLiteCacheBackend(config['FOURSQUARE_CACHE_PATH'], max_entries,
+                                         config['SQLITE_JOURNAL_MODE'], config['SQLITE_BUSY_TIMEOUT'])
+        else:
+            backend = MemoryCacheBackend(max_entries)
+        return SearchCache(backend, config['FOURSQUARE_CACHE_TTL'], config['FOURSQUARE_CACHE_PRECISION'])
+
+    # Method for building the cache key (returns None if the coordinates cannot be parsed)
+    def key(self, coords, category_ids, radius):
+        try:
+            lat, lng = (float(value) for value in coords.split(','))
+        except (AttributeError, ValueError):
+            return None
+        return f"{geohash(lat, lng, self.precision)}|{','.join(sorted(category_ids))}|{radius}"
+
+    def get(self, key):
+        if key is None or self.ttl <= 0:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        if key is not None and self.ttl > 0:
+            self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        return self.backend.stats()
+
+search_cache = SearchCache.from_config(app.config)
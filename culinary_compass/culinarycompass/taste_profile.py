@@ -0,0 +1,291 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from culinarycompass.models import UserProfile, RestaurantVisit
+from culinarycompass.recommendation_data import RecommendationData, MIN_RATING
+from culinarycompass import db
+
+# Stored, incrementally updated taste profile of a user (category counts + attribute sums)
+class TasteProfile:
+
+    # Method for creating an empty attribute dictionary
+    @staticmethod
+    def empty_attributes():
+        return {
+            'bar_service': 0.0,
+            'beer': 0.0,
+            'byo': 0.0,
+            'cocktails': 0.0,
+            'full_bar': 0.0,
+            'wine': 0.0,
+            'bar_snacks': 0.0,
+            'breakfast': 0.0,
+            'brunch': 0.0,
+            'lunch': 0.0,
+            'happy_hour': 0.0,
+            'dessert': 0.0,
+            'dinner': 0.0,
+            'tasting_menu': 0.0,
+            'business_meeting': 0.0,
+            'clean': 0.0,
+            'crowded': 0.0,
+            'dates_popular': 0.0,
+            'dressy': 0.0,
+            'families_popular': 0.0,
+            'gluten_free_diet': 0.0,
+            'good_for_dogs': 0.0,
+            'groups_popular': 0.0,
+            'healthy_diet': 0.0,
+            'late_night': 0.0,
+            'noisy': 0.0,
+            'quick_bite': 0.0,
+            'romantic': 0.0,
+            'service_quality': 0.0,
+            'singles_popular': 0.0,
+            'special_occasion': 0.0,
+            'trendy': 0.0,
+            'value_for_money': 0.0,
+            'vegan_diet': 0.0,
+            'vegetarian_diet': 0.0
+        }
+
+    # Method for counting a restaurant's categories (returns False if the restaurant has no categories)
+    @staticmethod
+    def count_categories(category_counts, restaurant):
+        categories = restaurant.category.split(',')
+
+        # Skip the restaurant if it has no categories
+        if not categories or categories == ['']:
+            return False
+
+        for category in categories:
+            # Skip the restaurant if the categories have no id
+            if ':' not in category:
+                continue
+            category_name, category_id = category.split(':')
+            category_counts[(category_name, category_id)] += 1
+        return True
+
+    # Method for counting a restaurant's features
+    @staticmethod
+    def count_features(attribute_sums, features):
+        if features:
+            for feature_name in attribute_sums.keys():
+                if hasattr(features, feature_name):
+                    feature_value = getattr(features, feature_name)
+                else:
+                    feature_value = None
+                if feature_value:
+                    attribute_sums[feature_name] += 1
+
+    # Method for normalizing attribute counts and applying the user questionnaire
+    @staticmethod
+    def normalize_attributes(attribute_sums, total_restaurants, user):
+        preferred_attributes = TasteProfile.empty_attributes()
+
+        # Normalize frequencies between 0 and 1
+        if total_restaurants:
+            for feature_name, frequency in attribute_sums.items():
+                preferred_attributes[feature_name] = frequency / total_restaurants
+
+        # Override frequencies with user questionnaire data
+        if user.vegetarianism == "vegetarian":
+            preferred_attributes['vegetarian_diet'] = 1.0
+        elif user.vegetarianism == "vegan":
+            preferred_attributes['vegan_diet'] = 1.0
+        if user.gluten:
+            preferred_attributes['gluten_free_diet'] = 1.0
+        if user.healthy:
+            preferred_attributes['healthy_diet'] = 1.0
+        if user.no_alcohol:
+            keys = ['bar_service', 'beer', 'byo', 'cocktails', 'full_bar', 'wine']
+            for key in keys:
+                preferred_attributes[key] = 0.0
+        return preferred_attributes
+
+    # Method for converting category counts to the stored form ("name:id" keys)
+    @staticmethod
+    def dump_categories(category_counts):
+        return {f"{category_name}:{category_id}": count for (category_name, category_id), count in category_counts.items()}
+
+    # Method for converting stored category counts back to a Counter
+    @staticmethod
+    def load_categories(stored_counts):
+        category_counts = Counter()
+        for category, count in stored_counts.items():
+            category_name, category_id = category.rsplit(':', 1)
+            category_counts[(category_name, category_id)] = count
+        return category_counts
+
+    # Method for computing category counts and attribute sums from the user's full visit history
+    @staticmethod
+    def compute(user_id):
+        category_counts = Counter()
+        attribute_sums = TasteProfile.empty_attributes()
+        restaurant_count = 0
+
+        for restaurant, features in RecommendationData.load_preferred_visits(user_id):
+            if TasteProfile.count_categories(category_counts, restaurant):
+                TasteProfile.count_features(attribute_sums, features)
+                restaurant_count += 1
+        return category_counts, attribute_sums, restaurant_count
+
+    # Method for rebuilding (or creating) the stored profile of a user from their full history
+    @staticmethod
+    def rebuild(user):
+        category_counts, attribute_sums, restaurant_count = TasteProfile.compute(user.id)
+
+        profile = db.session.get(UserProfile, user.id)
+        if profile is None:
+            profile = UserProfile(user_id=user.id)
+            db.session.add(profile)
+
+        profile.category_counts = TasteProfile.dump_categories(category_counts)
+        profile.attribute_sums = attribute_sums
+        profile.restaurant_count = restaurant_count
+        profile.preferred_attributes = TasteProfile.normalize_attributes(attribute_sums, restaurant_count, user)
+        return profile
+
+    # Method for loading a stored profile to change it (the row stays locked until the commit, so concurrent visits of
+    # the same user are applied one after the other on databases with row locks, SQLite locks the whole database)
+    @staticmethod
+    def locked(user_id):
+        return UserProfile.query.filter_by(user_id=user_id).with_for_update().populate_existing().one_or_none()
+
+    # Method for adding a new restaurant visit to the stored profile (call before committing the visit)
+    @staticmethod
+    def add_visit(user, restaurant_visit):
+        profile = TasteProfile.locked(user.id)
+
+        # Backfill the profile from history if it does not exist yet (the flush makes the new visit part of it)
+        if profile is None:
+            db.session.flush()
+            return TasteProfile.rebuild(user)
+
+        if restaurant_visit.rating < MIN_RATING:
+            return profile
+
+        loaded = RecommendationData.load_restaurants([restaurant_visit.restaurant_id])
+        if not loaded:
+            return profile
+        restaurant, features = loaded[0]
+
+        category_counts = TasteProfile.load_categories(profile.category_counts)
+        if TasteProfile.count_categories(category_counts, restaurant):
+            attribute_sums = dict(profile.attribute_sums)
+            TasteProfile.count_features(attribute_sums, features)
+
+            # Assign new objects so the JSON columns are marked as changed
+            profile.category_counts = TasteProfile.dump_categories(category_counts)
+            profile.attribute_sums = attribute_sums
+            profile.restaurant_count += 1
+            profile.preferred_attributes = TasteProfile.normalize_attributes(attribute_sums, profile.restaurant_count, user)
+        return profile
+
+    # Method for adding (weight > 0) or removing (weight < 0) a restaurant's category and feature counts
+    # (category is the stored "name:id" list, features maps feature names to values; returns the restaurant count change)
+    @staticmethod
+    def apply_restaurant(category_counts, attribute_sums, category, features, weight):
+        categories = category.split(',')
+        if not categories or categories == ['']:
+            return 0
+        for category in categories:
+            if ':' not in category:
+                continue
+            category_name, category_id = category.split(':')
+            category_counts[(category_name, category_id)] += weight
+        for feature_name in attribute_sums.keys():
+            if features.get(feature_name):
+                attribute_sums[feature_name] += weight
+        return weight
+
+    # Method for getting the parts of a restaurant's data that a profile counts (to skip refreshes that change neither)
+    @staticmethod
+    def profile_values(category, features):
+        return category, {feature_name for feature_name in TasteProfile.empty_attributes() if features.get(feature_name)}
+
+    # Method for updating the stored profiles of users who rated restaurants whose data was refreshed
+    # (changes maps restaurant ids to the old and new (category, features) pairs, call before committing)
+    @staticmethod
+    def refresh_restaurants(changes):
+        if not changes:
+            return 0
+
+        # Qualifying visits per user and refreshed restaurant (each visit was counted once in the profile)
+        visits_by_user = defaultdict(list)
+        for user_id, restaurant_id, visits in db.session.query(RestaurantVisit.user_id, RestaurantVisit.restaurant_id,
+                                                               func.count(RestaurantVisit.id)) \
+                .filter(RestaurantVisit.restaurant_id.in_(changes.keys())) \
+                .filter(RestaurantVisit.rating >= MIN_RATING) \
+                .group_by(RestaurantVisit.user_id, RestaurantVisit.restaurant_id):
+            visits_by_user[user_id].append((restaurant_id, visits))
+        if not visits_by_user:
+            return 0
+
+        # Users without a stored profile get one from their full history when they next need it
+        # (rows are locked in user order, so they are not changed by concurrent visits before the commit)
+        profiles = UserProfile.query.options(joinedload(UserProfile.user)) \
+            .filter(UserProfile.user_id.in_(visits_by_user.keys())) \
+            .order_by(UserProfile.user_id) \
+            .with_for_update(of=UserProfile) \
+            .populate_existing() \
+            .all()
+        for profile in profiles:
+            category_counts = TasteProfile.load_categories(profile.category_counts)
+            attribute_sums = dict(profile.attribute_sums)
+            restaurant_count = profile.restaurant_count
+            for restaurant_id, visits in visits_by_user[profile.user_id]:
+                (old_category, old_features), (new_category, new_features) = changes[restaurant_id]
+                restaurant_count += TasteProfile.apply_restaurant(category_counts, attribute_sums, old_category, old_features, -visits)
+                restaurant_count += TasteProfile.apply_restaurant(category_counts, attribute_sums, new_category, new_features, visits)
+
+            # Assign new objects so the JSON columns are marked as changed (categories that dropped to 0 are removed)
+            profile.category_counts = TasteProfile.dump_categories(+category_counts)
+            profile.attribute_sums = attribute_sums
+            profile.restaurant_count = restaurant_count
+            profile.preferred_attributes = TasteProfile.normalize_attributes(attribute_sums, restaurant_count, profile.user)
+        return len(profiles)
+
+    # Method for reapplying the questionnaire after the user updates it
+    @staticmethod
+    def update_questionnaire(user):
+        profile = TasteProfile.locked(user.id)
+        if profile is None:
+            return TasteProfile.rebuild(user)
+
+        profile.preferred_attributes = TasteProfile.normalize_attributes(profile.attribute_sums, profile.restaurant_count, user)
+        return profile
+
+    # Method for getting the user's top categories and preferred attributes from the stored profile
+    @staticmethod
+    def get_preferences(user):
+        profile = db.session.get(UserProfile, user.id)
+        if profile is None:
+            profile = TasteProfile.rebuild(user)
+            db.session.commit()
+
+        top_categories = [category for category, count in TasteProfile.load_categories(profile.category_counts).most_common(5)]
+        return top_categories, dict(profile.preferred_attributes)
+
+    # Method for checking the stored profile against a full recomputation (returns the mismatched fields)
+    @staticmethod
+    def check(user):
+        profile = db.session.get(UserProfile, user.id)
+        if profile is None:
+            return ['missing']
+
+        category_counts, attribute_sums, restaurant_count = TasteProfile.compute(user.id)
+        preferred_attributes = TasteProfile.normalize_attributes(attribute_sums, restaurant_count, user)
+
+        mismatches = []
+        if TasteProfile.load_categories(profile.category_counts) != category_counts:
+            mismatches.append('category_counts')
+        if profile.attribute_sums != attribute_sums:
+            mismatches.append('attribute_sums')
+        if profile.restaurant_count != restaurant_count:
+            mismatches.append('restaurant_count')
+        if profile.preferred_attributes != preferred_attributes:
+            mismatches.append('preferred_attributes')
+        return mismatches
@@ -0,0 +1,71 @@
+import time
+import secrets
+import threading
+
+from flask import session
+from sqlalchemy.orm import make_transient_to_detached
+
+from culinarycompass.models import User
+from culinarycompass import app, db, login_manager
+
+# Most cached users per worker process (the oldest entries are dropped first)
+USER_CACHE_SIZE = 10000
+
+# Cache of the logged in users' rows so page loads do not query the user table. Entries are keyed by the user id and a
+# version kept in the user's Flask session: a change made through the session gives it a new version, so every worker
+# loads the user again on the next request (changes made through another session show up after USER_CACHE_TTL)
+class UserCache:
+    users = {} # {(user_id, version): (detached user copy, expiry time)}, oldest first
+    lock = threading.Lock()
+
+    # Method for making a detached copy of a user's columns that can be shared between requests
+    @staticmethod
+    def detached_copy(user):
+        copy = User(**{column.key: getattr(user, column.key) for column in User.__mapper__.column_attrs})
+        make_transient_to_detached(copy)
+        return copy
+
+    # Method for getting a user in the current session (merged from the cache without a query when it is fresh)
+    @staticmethod
+    def get(user_id):
+        now = time.monotonic()
+        version = session.get('user_version')
+        with UserCache.lock:
+            cached = UserCache.users.get((user_id, version))
+        if cached is not None and cached[1] > now:
+            return db.session.merge(cached[0], load=False)
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        if version is None:
+            version = session['user_version'] = secrets.token_hex(8)
+        with UserCache.lock:
+            UserCache.users.pop((user_id, version), None)
+            UserCache.users[(user_id, version)] = (UserCache.detached_copy(user), now + app.config['USER_CACHE_TTL'])
+            UserCache.evict(now)
+        return user
+
+    # Method for dropping expired entries from the front, and the oldest entries over the limit (call with the lock)
+    @staticmethod
+    def evict(now):
+        users = UserCache.users
+        while users:
+            oldest_key = next(iter(users))
+            if users[oldest_key][1] > now and len(users) <= USER_CACHE_SIZE:
+                break
+            users.pop(oldest_key)
+
+    # Method for giving the session a new version after the user's row was changed through it (every worker then
+    # loads the changed row on the session's next request)
+    @staticmethod
+    def changed(user_id):
+        version = session.pop('user_version', None)
+        with UserCache.lock:
+            UserCache.users.pop((user_id, version), None)
+        session['user_version'] = secrets.token_hex(8)
+
+# Load user callback for flask-login
+@login_manager.user_loader
+def load_user(user_id):
+    return UserCache.get(int(user_id))
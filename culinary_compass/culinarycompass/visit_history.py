@@ -0,0 +1,165 @@
+import time
+import threading
+from datetime import datetime
+from dataclasses import dataclass, field
+
+from flask import session, has_request_context
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, contains_eager
+
+from culinarycompass.models import RestaurantVisit
+from culinarycompass.restaurant_search import RestaurantSearch
+from culinarycompass import app, db
+
+# Number of visits shown per page of the visit history
+HISTORY_PAGE_SIZE = 10
+
+# Search queries whose counts are cached per user (the oldest are dropped first)
+HISTORY_COUNT_QUERIES = 20
+
+# Users whose counts are cached per process (the least recently counted are dropped first)
+HISTORY_COUNT_USERS = 10000
+
+# One page of a user's visit history (newest first) with opaque cursors for the neighbouring pages
+@dataclass
+class HistoryPage:
+    items: list = field(default_factory=list)
+    next_cursor: str = None
+    prev_cursor: str = None
+    total: int = None # cached count of all the user's visits (approximate, see VisitHistory.count)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+# Visit history queries for the My Restaurants page
+class VisitHistory:
+    counts = {} # {user_id: {search query: (count, expiry time)}}, least recently counted user first
+    lock = threading.Lock()
+
+    # Method for getting the signed cursor serializer (cursors cannot be forged or edited)
+    @staticmethod
+    def serializer():
+        return URLSafeSerializer(app.config['SECRET_KEY'], salt='visit-history-cursor')
+
+    # Method for encoding the position of a visit as a cursor ('next' pages are older, 'prev' pages are newer)
+    @staticmethod
+    def encode_cursor(visit, direction):
+        return VisitHistory.serializer().dumps([visit.date_visited.isoformat(), visit.id, direction])
+
+    # Method for decoding a cursor (returns None if it is invalid)
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            date_visited, visit_id, direction = VisitHistory.serializer().loads(cursor)
+            if direction not in ('next', 'prev'):
+                return None
+            return datetime.fromisoformat(date_visited), int(visit_id), direction
+        except (BadSignature, ValueError, TypeError):
+            return None
+
+    # Method for getting a page of the user's visits after a cursor (a single seek on the user/date index)
+    @staticmethod
+    def page(user_id, cursor=None, per_page=HISTORY_PAGE_SIZE):
+        position = VisitHistory.decode_cursor(cursor) if cursor else None
+        query = RestaurantVisit.query \
+            .options(joinedload(RestaurantVisit.restaurant, innerjoin=True)) \
+            .filter(RestaurantVisit.user_id == user_id)
+        visit_key = tuple_(RestaurantVisit.date_visited, RestaurantVisit.id)
+
+        # Fetch one extra visit to find out if there is another page in the same direction
+        if position is None:
+            visits = query.order_by(RestaurantVisit.date_visited.desc(), RestaurantVisit.id.desc()).limit(per_page + 1).all()
+            more = len(visits) > per_page
+            visits = visits[:per_page]
+            has_older, has_newer = more, False
+        elif position[2] == 'next':
+            visits = query.filter(visit_key < tuple_(position[0], position[1])) \
+                .order_by(RestaurantVisit.date_visited.desc(), RestaurantVisit.id.desc()) \
+                .limit(per_page + 1).all()
+            more = len(visits) > per_page
+            visits = visits[:per_page]
+            has_older, has_newer = more, True
+        else:
+            visits = query.filter(visit_key > tuple_(position[0], position[1])) \
+                .order_by(RestaurantVisit.date_visited.asc(), RestaurantVisit.id.asc()) \
+                .limit(per_page + 1).all()
+            more = len(visits) > per_page
+            visits = visits[:per_page][::-1]
+            has_older, has_newer = True, more
+
+        history_page = HistoryPage(items=visits, total=VisitHistory.count(user_id))
+        if visits and has_older:
+            history_page.next_cursor = VisitHistory.encode_cursor(visits[-1], 'next')
+        if visits and has_newer:
+            history_page.prev_cursor = VisitHistory.encode_cursor(visits[0], 'prev')
+        return history_page
+
+    # Method for getting a numbered page of search results (ranked, so they are paged by offset with a cached count)
+    @staticmethod
+    def search_page(user_id, search_query, page=1, per_page=HISTORY_PAGE_SIZE):
+        query, ordering = RestaurantSearch.filter_visits(RestaurantVisit.query.filter_by(user_id=user_id), search_query)
+        pagination = query \
+            .options(contains_eager(RestaurantVisit.restaurant)) \
+            .order_by(*ordering, RestaurantVisit.date_visited.desc(), RestaurantVisit.id.desc()) \
+            .paginate(page=page, per_page=per_page, count=False)
+        pagination.total = VisitHistory.count(user_id, search_query)
+        return pagination
+
+    # Method for checking if the user has any visits (an existence check on the user/date index until it finds one,
+    # then remembered in the user's Flask session, which every worker sees, as visits are never deleted)
+    @staticmethod
+    def has_visits(user_id):
+        if has_request_context() and session.get('has_visits') == user_id:
+            return True
+        exists = db.session.query(RestaurantVisit.query.filter_by(user_id=user_id).exists()).scalar()
+        if exists and has_request_context():
+            session['has_visits'] = user_id
+        return exists
+
+    # Method for getting the (cached) number of the user's visits matching a search query (approximate: each worker
+    # process caches it for HISTORY_COUNT_TTL and only the worker that handled a new visit clears its copy)
+    @staticmethod
+    def count(user_id, search_query=''):
+        now = time.monotonic()
+        with VisitHistory.lock:
+            cached = VisitHistory.counts.get(user_id, {}).get(search_query)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        query = RestaurantVisit.query.filter_by(user_id=user_id)
+        if search_query:
+            query = RestaurantSearch.filter_visits(query, search_query)[0]
+        count = query.order_by(None).count()
+        with VisitHistory.lock:
+            # Move the user to the end, so users are ordered by their latest count (and so by expiry time)
+            user_counts = VisitHistory.counts.pop(user_id, {})
+            VisitHistory.counts[user_id] = user_counts
+            user_counts.pop(search_query, None)
+            user_counts[search_query] = (count, now + app.config['HISTORY_COUNT_TTL'])
+            while len(user_counts) > HISTORY_COUNT_QUERIES:
+                user_counts.pop(next(iter(user_counts)))
+            VisitHistory.evict(now)
+        return count
+
+    # Method for dropping users whose counts have all expired, and the oldest users over the limit (call with the lock)
+    @staticmethod
+    def evict(now):
+        counts = VisitHistory.counts
+        while counts:
+            oldest_user_id = next(iter(counts))
+            expired = all(expiry <= now for count, expiry in counts[oldest_user_id].values())
+            if not expired and len(counts) <= HISTORY_COUNT_USERS:
+                break
+            counts.pop(oldest_user_id)
+
+    # Method for clearing the user's cached counts (after a visit is added)
+    @staticmethod
+    def invalidate(user_id):
+        with VisitHistory.lock:
+            VisitHistory.counts.pop(user_id, None)
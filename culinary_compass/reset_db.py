@@ -1,5 +1,11 @@
 from culinarycompass import app, db
+from culinarycompass import models
+from culinarycompass.restaurant_search import RestaurantSearch
+from culinarycompass.restaurant_location import RestaurantLocation
 
 # Script to reset the database (development use)
 with app.app_context():
     db.create_all()
+    with db.engine.begin() as connection:
+        RestaurantSearch.create_index(connection)
+        RestaurantLocation.create_index(connection)
@@ -1,5 +1,6 @@
 from culinarycompass import app 
 from culinarycompass import routes
+from culinarycompass import commands
 
 # Only run app if run.py is called directly
 if __name__ == '__main__':